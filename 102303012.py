@@ -1,9 +1,9 @@
 import sys
 import os
 import shutil
-import random
-from yt_dlp import YoutubeDL
 from advanced_mashup import trim_all_mid, merge_with_crossfade
+from candidates import select_candidates
+from media_source import default_source
 
 DOWNLOAD_DIR = "downloads"
 TRIM_DIR = "trimmed"
@@ -17,50 +17,22 @@ def prepare_dirs():
     os.makedirs(DOWNLOAD_DIR)
     os.makedirs(TRIM_DIR)
 
-def download_videos(singer, n):
+def download_videos(singer, n, clip_sec=None):
     print(f"\nDownloading top {n} videos for: {singer}")
 
-    ydl_opts = {
-        "format": "bestaudio/best",
-        "outtmpl": f"{DOWNLOAD_DIR}/%(title)s.%(ext)s",
-        "quiet": False,
-        "noplaylist": True,
-        "skip_unavailable_fragments": True,
-        "retries": 5,
-        "fragment_retries": 3,
-        "socket_timeout": 15,
-        "ignoreerrors": True,
-        "nocheckcertificate": True,
-        "extract_flat": False,
-        "match_filters": "!is_live & !is_upcoming",
-        "js_runtimes": {"node": {}},
-    }
+    source = default_source()
 
     search_count = max(n * 3, n)
-    query = f"ytsearch{search_count}:{singer} songs"
+    entries = source.search(singer, "songs", search_count)
 
-    with YoutubeDL(ydl_opts) as ydl:
-        info = ydl.extract_info(query, download=False)
+    if not entries:
+        raise RuntimeError("No videos found for the artist.")
 
-        entries = []
-        if info and "entries" in info:
-            entries = [
-                e for e in info["entries"]
-                if e and e.get("webpage_url")
-            ]
+    selected = select_candidates(entries, n, clip_sec, source.selection_seed)
+    if not selected:
+        raise RuntimeError("No usable videos found for the artist.")
 
-        if not entries:
-            raise RuntimeError("No videos found for the artist.")
-
-        selected = (
-            random.sample(entries, k=min(n, len(entries)))
-            if len(entries) > n else entries
-        )
-
-        for entry in selected:
-            url = entry.get("webpage_url")
-            if url:
-                ydl.download([url])
+    source.download(selected, f"{DOWNLOAD_DIR}/%(title)s.%(ext)s")
 
 def trim_all(duration_sec):
     return trim_all_mid(duration_sec)
@@ -109,7 +81,7 @@ def main():
 
     try:
         prepare_dirs()
-        download_videos(singer, n)
+        download_videos(singer, n, clip_sec=duration)
         trimmed = trim_all(duration)
         merge_files(trimmed, output)
 
@@ -121,7 +93,7 @@ def main():
 
 def run_mashup(singer, n, duration, output):
     prepare_dirs()
-    download_videos(singer, n)
+    download_videos(singer, n, clip_sec=duration)
     trimmed = trim_all(duration)
     merge_files(trimmed, output)
 
@@ -1,13 +1,34 @@
+import contextvars
 import os
+import re
 import subprocess
 from concurrent.futures import ThreadPoolExecutor, as_completed
-from typing import List
+from typing import Iterable, Iterator, List, Optional
+import numpy as np
 from pydub import AudioSegment
 from pydub.effects import normalize
 from pydub.utils import which
+from ffmpeg_scheduler import PRIORITY_DECODE, PRIORITY_MERGE, PRIORITY_PROBE, PRIORITY_TRIM, ffmpeg_slot, job_scope, run_ffmpeg
+from job_context import DOWNLOAD_DIR, TRIM_DIR, JobContext
+from media_probe import probe_duration
+from pipeline import TRIM_WORKERS
 
-DOWNLOAD_DIR = "downloads"
-TRIM_DIR = "trimmed"
+# "mp3" keeps compressed clips between trim and merge; "wav" writes 16-bit PCM
+# at the merge rate so the merge reads samples without another decode.
+INTERMEDIATE_FORMAT = os.getenv("MASHUP_INTERMEDIATE_FORMAT", "mp3").lower()
+MERGE_SAMPLE_RATE = 44100
+MERGE_CHANNELS = 2
+# "numpy" decodes clips and mixes them in-process; "ffmpeg" runs the whole
+# merge as one ffmpeg filter graph; "stream" mixes block by block into one
+# encoder. With ffmpeg and stream the mashup job keeps only clip
+# fingerprints, not decoded clips, between trim and merge.
+MERGE_BACKEND = os.getenv("MASHUP_MERGE_BACKEND", "numpy").lower()
+# ffmpeg backend only: "peak" matches pydub's normalize(), "loudnorm" evens loudness (EBU R128).
+MERGE_NORMALIZE = os.getenv("MASHUP_MERGE_NORMALIZE", "peak").lower()
+# "stream" backend: PCM is decoded, mixed and encoded this many seconds at a time.
+MERGE_BLOCK_SEC = float(os.getenv("MASHUP_MERGE_BLOCK_SEC", "1"))
+
+_SAMPLE_DTYPES = {1: np.int8, 2: np.int16, 4: np.int32}
 
 _FFMPEG_CHECKED = False
 
@@ -20,21 +41,31 @@ def ensure_ffmpeg_tools() -> None:
         _FFMPEG_CHECKED = True
 
 
+def clip_path(trim_dir: str, source_path: str) -> str:
+    """Where the trimmed clip of source_path goes, with the intermediate format's extension"""
+    base_name = os.path.splitext(os.path.basename(source_path))[0]
+    ext = ".wav" if INTERMEDIATE_FORMAT == "wav" else ".mp3"
+    return os.path.join(trim_dir, base_name + ext)
+
+
+def clip_codec_args(mp3_bitrate: Optional[str] = None) -> List[str]:
+    """ffmpeg output options for a trimmed clip in the intermediate format"""
+    if INTERMEDIATE_FORMAT == "wav":
+        return ["-acodec", "pcm_s16le", "-ar", str(MERGE_SAMPLE_RATE), "-ac", str(MERGE_CHANNELS)]
+    return ["-acodec", "libmp3lame"] + (["-b:a", mp3_bitrate] if mp3_bitrate else [])
+
+
+def load_clip(path: str) -> AudioSegment:
+    """Read a trimmed clip; WAV clips are parsed in-process without ffmpeg"""
+    if path.lower().endswith(".wav"):
+        return AudioSegment.from_wav(path)
+    with ffmpeg_slot(PRIORITY_DECODE):
+        return AudioSegment.from_file(path)
+
+
 def get_duration_seconds(path: str) -> float:
-    """Get audio duration using ffprobe with optimized args"""
-    result = subprocess.run(
-        ["ffprobe", "-v", "error", "-show_entries", "format=duration",
-         "-of", "default=nw=1:nk=1", path],
-        stdout=subprocess.PIPE,
-        stderr=subprocess.DEVNULL,
-        text=True,
-        check=True,
-        timeout=10
-    )
-    try:
-        return float(result.stdout.strip())
-    except ValueError:
-        raise RuntimeError(f"Could not read duration for: {path}")
+    """Audio duration from download metadata or the file header, ffprobe as last resort"""
+    return probe_duration(path)
 
 
 def trim_mid_chunk(path: str, out_path: str, duration_sec: int, timeout: int = 60) -> None:
@@ -46,9 +77,10 @@ def trim_mid_chunk(path: str, out_path: str, duration_sec: int, timeout: int = 6
     start = max(0.0, (total - duration_sec) / 2.0) if total > duration_sec else 0
 
     try:
-        subprocess.run(
+        run_ffmpeg(
             ["ffmpeg", "-y", "-ss", f"{start:.3f}", "-i", path, "-t", str(duration_sec),
-             "-vn", "-acodec", "libmp3lame", out_path],
+             "-vn", *clip_codec_args(), out_path],
+            PRIORITY_TRIM,
             stdout=subprocess.DEVNULL,
             stderr=subprocess.PIPE,
             text=True,
@@ -60,25 +92,29 @@ def trim_mid_chunk(path: str, out_path: str, duration_sec: int, timeout: int = 6
 
 
 
-def trim_all_mid(duration_sec: int) -> List[str]:
+def trim_one_mid(path: str, duration_sec: int, ctx: Optional[JobContext] = None) -> str:
+    """Trim one download into the job's trim dir and return the clip path"""
+    out_path = clip_path(ctx.trim_dir if ctx else TRIM_DIR, path)
+    trim_mid_chunk(path, out_path, duration_sec)
+    return out_path
+
+
+def trim_all_mid(duration_sec: int, ctx: Optional[JobContext] = None) -> List[str]:
     """Trim all downloads from middle, using list comprehension for efficiency"""
     ensure_ffmpeg_tools()
     print("\nTrimming audio files from the middle...")
     
-    entries = [entry for entry in os.scandir(DOWNLOAD_DIR) if entry.is_file()]
+    download_dir = ctx.download_dir if ctx else DOWNLOAD_DIR
+    entries = [entry for entry in os.scandir(download_dir) if entry.is_file()]
     trimmed_files: List[str] = []
 
     def _trim_one(entry):
-        file = entry.name
-        path = entry.path
-        out_name = os.path.splitext(file)[0] + ".mp3"
-        out_path = os.path.join(TRIM_DIR, out_name)
-        trim_mid_chunk(path, out_path, duration_sec)
-        return out_path, out_name
-
-    max_workers = min(4, (os.cpu_count() or 2))
-    with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        futures = {executor.submit(_trim_one, entry): entry for entry in entries}
+        out_path = trim_one_mid(entry.path, duration_sec, ctx)
+        return out_path, os.path.basename(out_path)
+
+    # The ffmpeg scheduler bounds how many trims actually run at once.
+    with job_scope(ctx.job_id if ctx else None), ThreadPoolExecutor(max_workers=TRIM_WORKERS) as executor:
+        futures = {executor.submit(contextvars.copy_context().run, _trim_one, entry): entry for entry in entries}
         for future in as_completed(futures):
             entry = futures[future]
             try:
@@ -91,19 +127,297 @@ def trim_all_mid(duration_sec: int) -> List[str]:
     return trimmed_files
 
 
-def merge_with_crossfade(files: List[str], output_file: str, crossfade_ms: int = 2500) -> None:
-    """Merge audio files with crossfade, optimized for memory"""
-    print("\nMerging files with smooth crossfades...")
+def prepare_clip(path: str) -> AudioSegment:
+    """Decode and normalize one clip for merging"""
+    return normalize(load_clip(path))
 
-    if not files:
+
+def _synced(segments: List[AudioSegment]) -> List[AudioSegment]:
+    """Clips at the most channels, highest rate and widest samples among them, as append() does"""
+    channels = max(segment.channels for segment in segments)
+    frame_rate = max(segment.frame_rate for segment in segments)
+    sample_width = max(segment.sample_width for segment in segments)
+    return [
+        segment.set_channels(channels).set_frame_rate(frame_rate).set_sample_width(sample_width)
+        for segment in segments
+    ]
+
+
+def _fade_frames(lengths: List[int], rate: int, crossfade_ms: int, within_previous: bool = False) -> List[int]:
+    """Crossfade length in frames between each clip and the mix before it (0 for the first).
+
+    Capped at half of the mix so far and half of the clip, as merges always
+    did; within_previous also keeps it inside the previous clip alone.
+    """
+    fades = [0]
+    total = lengths[0]
+    for previous, length in zip(lengths, lengths[1:]):
+        fade_ms = min(crossfade_ms, round(total * 1000 / rate) // 2, round(length * 1000 / rate) // 2)
+        fade = min(fade_ms * rate // 1000, previous if within_previous else total, length)
+        fades.append(fade)
+        total += length - fade
+    return fades
+
+
+def _blend(tail: np.ndarray, head: np.ndarray) -> np.ndarray:
+    """Fade tail out and head in over their common length, saturating like audioop"""
+    limits = np.iinfo(head.dtype)
+    ramp = (np.arange(len(head), dtype=np.float64) / len(head))[:, None]
+    return np.clip(tail * (1.0 - ramp) + head * ramp, limits.min, limits.max).astype(head.dtype)
+
+
+def render_crossfade(segments: Iterable[AudioSegment], crossfade_ms: int = 2500) -> AudioSegment:
+    """Crossfade clips in order into one preallocated buffer.
+
+    Same mix as chaining AudioSegment.append(crossfade=...) with the fade
+    capped at half of the mix so far and half of the incoming clip, but every
+    offset is known up front and each clip is written once, so time and
+    memory grow linearly with the number of clips. Fades are linear per
+    sample rather than per millisecond, and clips are aligned to the sample.
+    """
+    clips = list(segments)
+    if not clips:
         raise RuntimeError("No audio files available to merge")
+    clips = _synced(clips)
+    rate, channels, width = clips[0].frame_rate, clips[0].channels, clips[0].sample_width
+    dtype = _SAMPLE_DTYPES[width]
+
+    lengths = [int(clip.frame_count()) for clip in clips]
+    fades = _fade_frames(lengths, rate, crossfade_ms)
+    offsets = [0]
+    for length, fade in zip(lengths, fades[1:]):
+        offsets.append(offsets[-1] + length - fade)
+    total = offsets[-1] + lengths[-1]
+
+    # The returned segment takes over this buffer, so the mix is never copied.
+    data = bytearray(total * channels * width)
+    mix = np.frombuffer(data, dtype=dtype).reshape(total, channels)
+    for clip, offset, fade, length in zip(clips, offsets, fades, lengths):
+        samples = np.frombuffer(clip.raw_data, dtype=dtype, count=length * channels).reshape(length, channels)
+        if fade:
+            mix[offset:offset + fade] = _blend(mix[offset:offset + fade], samples[:fade])
+        mix[offset + fade:offset + length] = samples[fade:]
 
-    final_audio = normalize(AudioSegment.from_file(files[0]))
+    return AudioSegment(data=data, sample_width=width, frame_rate=rate, channels=channels)
 
-    for f in files[1:]:
-        segment = normalize(AudioSegment.from_file(f))
-        effective_fade = min(crossfade_ms, len(final_audio) // 2, len(segment) // 2)
-        final_audio = final_audio.append(segment, crossfade=effective_fade)
 
-    final_audio.export(output_file, format="mp3", bitrate="192k")
+def merge_prepared(segments: Iterable[AudioSegment], output_file: str, crossfade_ms: int = 2500) -> None:
+    """Crossfade already-normalized clips in order and export the mashup"""
+    print("\nMerging files with smooth crossfades...")
+
+    final_audio = render_crossfade(segments, crossfade_ms)
+
+    export_mp3(final_audio, output_file, "192k")
     print(f"Final mashup created: {output_file}")
+
+
+class Mp3Encoder:
+    """Long-running ffmpeg/LAME process that encodes s16le PCM written to its stdin.
+
+    Use as a context manager; a failed encode or an exception in the body
+    kills the process and removes the partial output.
+    """
+
+    def __init__(self, output_file: str, bitrate: str = "192k",
+                 sample_rate: int = MERGE_SAMPLE_RATE, channels: int = MERGE_CHANNELS):
+        self.output_file = output_file
+        self.proc = subprocess.Popen(
+            ["ffmpeg", "-y", "-v", "error", "-f", "s16le", "-ar", str(sample_rate), "-ac", str(channels),
+             "-i", "pipe:0", "-c:a", "libmp3lame", "-b:a", bitrate, output_file],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+        )
+
+    def write(self, pcm) -> None:
+        try:
+            self.proc.stdin.write(pcm)
+        except BrokenPipeError:
+            raise RuntimeError(f"Encoder exited early: {self._errors()}")
+
+    def _errors(self) -> str:
+        self.proc.wait()
+        return self.proc.stderr.read().decode("utf-8", "replace").strip()[-500:]
+
+    def __enter__(self) -> "Mp3Encoder":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if exc_type is None:
+            self.proc.stdin.close()
+            if self.proc.wait():
+                raise RuntimeError(f"Encoding {self.output_file} failed: {self._errors()}")
+            self.proc.stderr.close()
+            return
+        self.proc.kill()
+        self.proc.wait()
+        for pipe in (self.proc.stdin, self.proc.stderr):
+            try:
+                pipe.close()
+            except OSError:
+                pass
+        if os.path.exists(self.output_file):
+            os.remove(self.output_file)
+
+
+def export_mp3(segment: AudioSegment, output_file: str, bitrate: str = "192k") -> None:
+    """Encode segment by piping its samples to the encoder, without pydub's temporary WAV copy"""
+    segment = segment.set_sample_width(2)
+    data = memoryview(segment.raw_data)
+    block = int(segment.frame_rate * MERGE_BLOCK_SEC) * segment.frame_width
+    with ffmpeg_slot(PRIORITY_MERGE), Mp3Encoder(output_file, bitrate, segment.frame_rate, segment.channels) as encoder:
+        for start in range(0, len(data), block):
+            encoder.write(data[start:start + block])
+
+
+def _decode_blocks(path: str, gain_db: float, block_frames: int) -> Iterator[np.ndarray]:
+    """Blocks of path as (frames, channels) int16 at the merge format, with gain applied.
+
+    Runs inside the caller's ffmpeg slot.
+    """
+    proc = subprocess.Popen(
+        ["ffmpeg", "-v", "error", "-i", path, "-vn", "-af", f"volume={gain_db:.2f}dB",
+         "-ac", str(MERGE_CHANNELS), "-ar", str(MERGE_SAMPLE_RATE), "-f", "s16le", "-"],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+    )
+    frame_bytes = 2 * MERGE_CHANNELS
+    try:
+        while True:
+            data = proc.stdout.read(block_frames * frame_bytes)
+            frames = len(data) // frame_bytes
+            if frames:
+                yield np.frombuffer(data, dtype="<i2", count=frames * MERGE_CHANNELS).reshape(frames, MERGE_CHANNELS)
+            if len(data) < block_frames * frame_bytes:
+                break
+    finally:
+        proc.stdout.close()
+        try:
+            proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+            proc.wait()
+    if proc.returncode:
+        raise RuntimeError(f"Could not decode {path}")
+
+
+def merge_streaming(files: List[str], output_file: str, crossfade_ms: int = 2500) -> None:
+    """Crossfade files into one encoder process a block at a time.
+
+    Each clip is decoded only when its turn comes, with its peak gain applied
+    by ffmpeg. The last fade's worth of the mix is held back until the next
+    clip's head arrives to blend with it, so memory stays at about one fade
+    plus one block however long the mashup is. The merge holds a single
+    ffmpeg slot for the encoder and the decoder feeding it.
+    """
+    ensure_ffmpeg_tools()
+    print("\nMerging files as a stream...")
+
+    with ThreadPoolExecutor(max_workers=TRIM_WORKERS) as executor:
+        peaks = [executor.submit(contextvars.copy_context().run, _peak_db, path) for path in files]
+        gains = [-0.1 - peak if peak != float("-inf") else 0.0 for peak in (f.result() for f in peaks)]
+
+    lengths = [int(get_duration_seconds(path) * MERGE_SAMPLE_RATE) for path in files]
+    fades = _fade_frames(lengths, MERGE_SAMPLE_RATE, crossfade_ms, within_previous=True) + [0]
+    block_frames = max(1, int(MERGE_SAMPLE_RATE * MERGE_BLOCK_SEC))
+
+    with ffmpeg_slot(PRIORITY_MERGE), Mp3Encoder(output_file) as encoder:
+        tail = np.zeros((0, MERGE_CHANNELS), dtype=np.int16)
+        for index, path in enumerate(files):
+            hold = fades[index + 1]
+            pending = tail[:0]
+            blended = not len(tail)
+            for block in _decode_blocks(path, gains[index], block_frames):
+                pending = np.concatenate((pending, block))
+                if not blended:
+                    if len(pending) < len(tail):
+                        continue
+                    pending[:len(tail)] = _blend(tail, pending[:len(tail)])
+                    blended = True
+                if len(pending) > hold:
+                    encoder.write(pending[:len(pending) - hold].tobytes())
+                    pending = pending[len(pending) - hold:]
+            if not blended:
+                # Clip shorter than its fade: play out the rest of the tail, then blend.
+                encoder.write(tail[:len(tail) - len(pending)].tobytes())
+                if len(pending):
+                    pending = _blend(tail[len(tail) - len(pending):], pending)
+                encoder.write(pending[:max(0, len(pending) - hold)].tobytes())
+                pending = pending[max(0, len(pending) - hold):]
+            tail = pending
+        encoder.write(tail.tobytes())
+    print(f"Final mashup created: {output_file}")
+
+
+def _peak_db(path: str) -> float:
+    """Sample peak of path in dBFS, measured by ffmpeg's volumedetect"""
+    result = run_ffmpeg(
+        ["ffmpeg", "-hide_banner", "-nostats", "-i", path, "-vn", "-af", "volumedetect", "-f", "null", "-"],
+        PRIORITY_PROBE,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        text=True,
+        check=True,
+    )
+    found = re.search(r"max_volume:\s*(-?[\d.]+|-inf) dB", result.stderr)
+    if not found:
+        raise RuntimeError(f"Could not measure peak for: {path}")
+    return float(found.group(1))
+
+
+def _input_filter(path: str) -> str:
+    """Per-input filters: normalize, then convert to the merge format"""
+    layout = "stereo" if MERGE_CHANNELS == 2 else "mono"
+    convert = f"aresample={MERGE_SAMPLE_RATE},aformat=sample_fmts=fltp:channel_layouts={layout}"
+    if MERGE_NORMALIZE == "loudnorm":
+        return f"loudnorm=I=-14:TP=-1.5:LRA=11,{convert}"
+    peak = _peak_db(path)
+    # Same target as pydub's normalize(): peak at -0.1 dBFS; silence is left alone.
+    gain = -0.1 - peak if peak != float("-inf") else 0.0
+    return f"{convert},volume={gain:.2f}dB"
+
+
+def merge_with_ffmpeg(files: List[str], output_file: str, crossfade_ms: int = 2500) -> None:
+    """Normalize, crossfade and encode files in one ffmpeg filter graph.
+
+    Fades follow merge_prepared: each is capped at half of the mix so far and
+    half of the incoming clip, with linear (tri) curves.
+    """
+    ensure_ffmpeg_tools()
+    print("\nMerging files with an ffmpeg filter graph...")
+
+    # Peak measurements are separate ffmpeg runs, so take them side by side.
+    with ThreadPoolExecutor(max_workers=TRIM_WORKERS) as executor:
+        filters = [executor.submit(contextvars.copy_context().run, _input_filter, path) for path in files]
+        graph = [f"[{i}:a]{future.result()}[n{i}]" for i, future in enumerate(filters)]
+    mix, mix_sec = "n0", get_duration_seconds(files[0])
+    for i, path in enumerate(files[1:], start=1):
+        clip_sec = get_duration_seconds(path)
+        fade_sec = min(crossfade_ms / 1000.0, mix_sec / 2, clip_sec / 2)
+        graph.append(f"[{mix}][n{i}]acrossfade=d={fade_sec:.3f}:c1=tri:c2=tri[x{i}]")
+        mix, mix_sec = f"x{i}", mix_sec + clip_sec - fade_sec
+
+    cmd = ["ffmpeg", "-y", "-hide_banner", "-nostats", "-v", "error"]
+    for path in files:
+        cmd += ["-i", path]
+    cmd += ["-filter_complex", ";".join(graph), "-map", f"[{mix}]",
+            "-c:a", "libmp3lame", "-b:a", "192k", output_file]
+    try:
+        run_ffmpeg(cmd, PRIORITY_MERGE, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True, check=True)
+    except subprocess.CalledProcessError as e:
+        raise RuntimeError(f"ffmpeg merge failed: {(e.stderr or '').strip()[-500:]}")
+    print(f"Final mashup created: {output_file}")
+
+
+def merge_with_crossfade(files: List[str], output_file: str, crossfade_ms: int = 2500) -> None:
+    """Merge audio files with crossfade, optimized for memory"""
+    if not files:
+        raise RuntimeError("No audio files available to merge")
+
+    if MERGE_BACKEND == "ffmpeg":
+        merge_with_ffmpeg(files, output_file, crossfade_ms)
+        return
+    if MERGE_BACKEND == "stream":
+        merge_streaming(files, output_file, crossfade_ms)
+        return
+    merge_prepared((prepare_clip(f) for f in files), output_file, crossfade_ms)
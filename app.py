@@ -10,8 +10,13 @@ import string
 from time import sleep
 from datetime import datetime
 from dotenv import load_dotenv
-from mashup_core import run_mashup, DOWNLOAD_DIR, TRIM_DIR
+from mashup_core import run_mashup
+from job_context import DOWNLOAD_DIR, JobContext
 from mongodb_helper import mongo_handler
+from pipeline import pipeline_depths
+from download_governor import governor
+from media_probe import probe_stats
+from ffmpeg_scheduler import ffmpeg_stats
 
 V2_DIR = os.path.join(os.path.dirname(__file__), "v-2-multimash")
 if V2_DIR not in sys.path:
@@ -32,6 +37,10 @@ SOCKET_ROOM_BY_SID = {}
 STREAM_ROOMS_LOCAL = {}
 STREAM_HOSTS = {}
 LAST_CHAT_BY_SID = {}
+# Finished jobs by job id, so preview endpoints only ever see the job they are asked about.
+JOBS_BY_ID = {}
+JOBS_BY_ID_MAX = 256
+_JOBS_LOCK = threading.Lock()
 
 HOME_HTML = """
 <!DOCTYPE html>
@@ -882,7 +891,7 @@ window.addEventListener("load", function() {
 
 </head>
 
-<body data-ok="{{ 1 if ok_any else 0 }}">
+<body data-ok="{{ 1 if ok_any else 0 }}" data-job="{{ job_id or '' }}">
 <div class="page">
     <div class="ribbon"></div>
 
@@ -3027,43 +3036,32 @@ if (ROOM_CODE) {
 </html>
 """
 
-def cleanup_after_email(session_id=None):
-    """Clean up generated files and delete songs from MongoDB after email sent."""
+def _remember_job(ctx):
+    """Make a finished job's artist info and audio reachable under its job id."""
+    with _JOBS_LOCK:
+        JOBS_BY_ID[ctx.job_id] = ctx
+        while len(JOBS_BY_ID) > JOBS_BY_ID_MAX:
+            JOBS_BY_ID.pop(next(iter(JOBS_BY_ID)))
+
+
+def _find_job(job_id):
+    with _JOBS_LOCK:
+        return JOBS_BY_ID.get(job_id) if job_id else None
+
+
+def cleanup_after_email(session_id=None, ctx=None):
+    """Clean up the job workspace and delete songs from MongoDB after email sent."""
     def delayed_cleanup():
         sleep(15)
         
         if mongo_handler.connected and session_id:
             mongo_handler.delete_session_songs(session_id)
-        
-        for f in ("result.mp3", "result.zip"):
-            try:
-                if os.path.exists(f):
-                    os.remove(f)
-                    print(f"Deleted: {f}")
-            except Exception as e:
-                print(f"Warning: Could not delete {f}: {e}")
-        
-        try:
-            if os.path.exists(DOWNLOAD_DIR):
-                for file in os.listdir(DOWNLOAD_DIR):
-                    try:
-                        os.remove(os.path.join(DOWNLOAD_DIR, file))
-                    except:
-                        pass
-                print(f"Cleared {DOWNLOAD_DIR}")
-        except Exception as e:
-            print(f"Warning: Could not clear downloads: {e}")
-
-        try:
-            if os.path.exists(TRIM_DIR):
-                for file in os.listdir(TRIM_DIR):
-                    try:
-                        os.remove(os.path.join(TRIM_DIR, file))
-                    except:
-                        pass
-                print(f"Cleared {TRIM_DIR}")
-        except Exception as e:
-            print(f"Warning: Could not clear trimmed: {e}")
+
+        if ctx:
+            with _JOBS_LOCK:
+                JOBS_BY_ID.pop(ctx.job_id, None)
+            ctx.cleanup()
+            print(f"Cleared job workspace: {ctx.workspace}")
     
     threading.Thread(target=delayed_cleanup, daemon=True).start()
 
@@ -3090,19 +3088,42 @@ def send_email(to_email, zip_path):
 
 @app.route("/get-artist-info", methods=["GET"])
 def get_artist_info():
-    """Optimized artist info retrieval"""
-    from mashup_core import ARTIST_INFO
-
-    result = {"thumbnail": ARTIST_INFO.get("thumbnail", ""), "first_audio": ""}
+    """Artist info of the job named by ?job=<job id>"""
+    ctx = _find_job(request.args.get("job"))
+    result = {"thumbnail": ctx.artist_info.get("thumbnail", "") if ctx else "", "first_audio": ""}
     
-    if os.path.exists(DOWNLOAD_DIR):
-        files = os.listdir(DOWNLOAD_DIR)
+    if ctx and os.path.exists(ctx.download_dir):
+        files = os.listdir(ctx.download_dir)
         if files:
-            result["first_audio"] = f"/audio/{files[0]}"
+            result["first_audio"] = f"/audio/{files[0]}?job={ctx.job_id}"
     
     return result
 
 
+@app.route("/pipeline-stats", methods=["GET"])
+def pipeline_stats():
+    """Per-stage queue depths of running mashup jobs"""
+    return jsonify(pipeline_depths())
+
+
+@app.route("/download-stats", methods=["GET"])
+def download_stats():
+    """Download slots in use per job, waiters and the bandwidth cap"""
+    return jsonify(governor.stats())
+
+
+@app.route("/probe-stats", methods=["GET"])
+def duration_probe_stats():
+    """How often track durations came from metadata, file headers or ffprobe"""
+    return jsonify(probe_stats())
+
+
+@app.route("/ffmpeg-stats", methods=["GET"])
+def ffmpeg_scheduler_stats():
+    """ffmpeg slots in use per job, waiters and queue wait per priority"""
+    return jsonify(ffmpeg_stats())
+
+
 @app.route("/stream", methods=["GET"])
 def stream_home():
     return render_template_string(STREAM_HTML, room_code=None, room_error=None)
@@ -3131,8 +3152,13 @@ def stream_room(code):
 
 @app.route("/audio/<filename>", methods=["GET"])
 def serve_audio(filename):
-    """Serve audio files from downloads directory"""
-    filepath = os.path.join(DOWNLOAD_DIR, filename)
+    """Serve audio from the downloads of the job named by ?job=<job id> (the shared CLI dir without one)"""
+    job_id = request.args.get("job")
+    ctx = _find_job(job_id)
+    if job_id and not ctx:
+        return ("File not found", 404)
+    download_dir = ctx.download_dir if ctx else DOWNLOAD_DIR
+    filepath = os.path.join(download_dir, os.path.basename(filename))
     return send_file(filepath, mimetype="audio/mpeg") if os.path.exists(filepath) else ("File not found", 404)
 
 
@@ -3297,9 +3323,11 @@ def home():
     ok_single = False
     msg_multi = None
     ok_multi = False
+    job_id = None
 
     if request.method == "POST":
         form_type = request.form.get("form_type", "single")
+        ctx = None
 
         if form_type == "multi":
             try:
@@ -3315,22 +3343,31 @@ def home():
                 if dur <= 20:
                     raise RuntimeError("Duration must be greater than 20 seconds")
 
-                session_id = run_multi_mashup(queries, total_videos, dur, "result.mp3", email, mode=mode)
+                ctx = JobContext.resumable("multi", mode, queries, total_videos, dur, email)
+                session_id = run_multi_mashup(queries, total_videos, dur, ctx.output_path, email, mode=mode, ctx=ctx)
+                _remember_job(ctx)
+                job_id = ctx.job_id
 
-                with zipfile.ZipFile("result.zip", "w") as z:
-                    z.write("result.mp3")
+                with zipfile.ZipFile(ctx.zip_path, "w") as z:
+                    z.write(ctx.output_path, arcname="result.mp3")
 
-                email_sent = send_email(email, "result.zip")
+                email_sent = send_email(email, ctx.zip_path)
 
                 if email_sent:
                     msg_multi = "Premium multi mashup generated and emailed successfully!"
                     ok_multi = True
-                    cleanup_after_email(session_id)
+                    cleanup_after_email(session_id, ctx)
                 else:
-                    msg_multi = "Warning: Multi mashup created but email failed. File is ready at: result.zip"
+                    msg_multi = f"Warning: Multi mashup created but email failed. File is ready at: {ctx.zip_path}"
+                    ctx.release()
 
             except Exception as e:
                 msg_multi = str(e)
+                if ctx and ctx.ledger:
+                    # Keep the workspace: resubmitting the same job resumes from its ledger.
+                    ctx.release()
+                elif ctx:
+                    ctx.cleanup()
 
         else:
             try:
@@ -3342,22 +3379,31 @@ def home():
                 if n <= 10 or dur <= 20:
                     raise RuntimeError("Videos must be >10 and duration >20")
 
-                session_id = run_mashup(singer, n, dur, "result.mp3", email)
+                ctx = JobContext.resumable("single", singer.strip(), n, dur, email)
+                session_id = run_mashup(singer, n, dur, ctx.output_path, email, ctx=ctx)
+                _remember_job(ctx)
+                job_id = ctx.job_id
 
-                with zipfile.ZipFile("result.zip", "w") as z:
-                    z.write("result.mp3")
+                with zipfile.ZipFile(ctx.zip_path, "w") as z:
+                    z.write(ctx.output_path, arcname="result.mp3")
 
-                email_sent = send_email(email, "result.zip")
+                email_sent = send_email(email, ctx.zip_path)
 
                 if email_sent:
                     msg_single = "Mashup generated and emailed successfully!"
                     ok_single = True
-                    cleanup_after_email(session_id)
+                    cleanup_after_email(session_id, ctx)
                 else:
-                    msg_single = "Warning: Mashup created but email failed. File is ready at: result.zip"
+                    msg_single = f"Warning: Mashup created but email failed. File is ready at: {ctx.zip_path}"
+                    ctx.release()
 
             except Exception as e:
                 msg_single = str(e)
+                if ctx and ctx.ledger:
+                    # Keep the workspace: resubmitting the same job resumes from its ledger.
+                    ctx.release()
+                elif ctx:
+                    ctx.cleanup()
 
     return render_template_string(
         HOME_HTML,
@@ -3366,6 +3412,7 @@ def home():
         msg_multi=msg_multi,
         ok_multi=ok_multi,
         ok_any=bool(ok_single or ok_multi),
+        job_id=job_id,
     )
 
 @app.route("/pricing", methods=["GET"])
@@ -0,0 +1,124 @@
+"""Persistent on-disk cache of downloaded source audio, keyed by video ID"""
+
+import os
+import re
+import shutil
+import tempfile
+import threading
+from typing import Callable, Optional
+
+CACHE_DIR = os.getenv("MASHUP_CACHE_DIR", ".mashup_cache")
+SOURCE_CACHE_MAX_MB = float(os.getenv("MASHUP_SOURCE_CACHE_MAX_MB", "2048"))
+
+
+def link_or_copy(src: str, dest: str) -> None:
+    """Hard-link src to dest, falling back to a copy across filesystems"""
+    try:
+        os.link(src, dest)
+    except OSError:
+        shutil.copyfile(src, dest)
+
+
+def evict_oldest(root: str, max_bytes: int, cached: Callable[[str], bool]) -> None:
+    """Remove the least recently used (oldest mtime) files in root until they fit in max_bytes.
+
+    cached(name) picks which files count; the caller holds its cache lock.
+    """
+    stats = []
+    try:
+        for entry in os.scandir(root):
+            if entry.is_file() and cached(entry.name):
+                stat = entry.stat()
+                stats.append((stat.st_mtime, stat.st_size, entry.path))
+    except OSError:
+        return
+
+    stats.sort()
+    total = sum(size for _, size, _ in stats)
+    for _, size, path in stats:
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+            total -= size
+        except OSError:
+            pass
+
+
+class SourceCache:
+    """Size-bounded LRU cache; file mtime doubles as the last-used stamp"""
+
+    def __init__(self, root: str, max_bytes: int):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.enabled = max_bytes > 0
+        self._lock = threading.Lock()
+        if self.enabled:
+            os.makedirs(self.root, exist_ok=True)
+
+    @staticmethod
+    def _key(video_id: str) -> str:
+        return re.sub(r"[^A-Za-z0-9_-]", "_", video_id)
+
+    def lookup(self, video_id: Optional[str]) -> Optional[str]:
+        """Return the cached file for video_id and mark it recently used"""
+        if not self.enabled or not video_id:
+            return None
+
+        prefix = self._key(video_id) + "."
+        try:
+            for entry in os.scandir(self.root):
+                if entry.is_file() and entry.name.startswith(prefix) and not entry.name.endswith(".part"):
+                    os.utime(entry.path)
+                    return entry.path
+        except OSError:
+            pass
+        return None
+
+    def materialize(self, video_id: Optional[str], dest_without_ext: str) -> Optional[str]:
+        """Place a cached copy at dest_without_ext + cached extension on a hit"""
+        cached = self.lookup(video_id)
+        if not cached:
+            return None
+
+        dest = dest_without_ext + os.path.splitext(cached)[1]
+        try:
+            if os.path.exists(dest):
+                os.remove(dest)
+            link_or_copy(cached, dest)
+        except OSError as e:
+            print(f"Warning: Source cache read failed for {video_id}: {e}")
+            return None
+        return dest
+
+    def insert(self, video_id: Optional[str], path: str) -> Optional[str]:
+        """Atomically add path to the cache, then evict least-recently-used files"""
+        if not self.enabled or not video_id or not os.path.isfile(path):
+            return None
+
+        final_path = os.path.join(self.root, self._key(video_id) + os.path.splitext(path)[1])
+        fd, tmp_path = tempfile.mkstemp(dir=self.root, suffix=".part")
+        os.close(fd)
+        try:
+            os.remove(tmp_path)
+            link_or_copy(path, tmp_path)
+            os.replace(tmp_path, final_path)
+            os.utime(final_path)
+        except OSError as e:
+            print(f"Warning: Source cache insert failed for {video_id}: {e}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return None
+
+        self.evict()
+        return final_path
+
+    def evict(self) -> None:
+        with self._lock:
+            evict_oldest(self.root, self.max_bytes, lambda name: not name.endswith(".part"))
+
+
+source_cache = SourceCache(
+    os.path.join(CACHE_DIR, "sources"),
+    int(SOURCE_CACHE_MAX_MB * 1024 * 1024),
+)
@@ -0,0 +1,89 @@
+"""Metadata-only candidate scoring so only likely-usable tracks get downloaded"""
+
+import math
+import os
+import random
+import re
+from typing import Dict, List, Optional, Tuple
+
+from dedupe import dedupe_entries
+
+MAX_TRACK_SEC = float(os.getenv("MASHUP_MAX_TRACK_SEC", "600"))
+MIN_TRACK_PADDING_SEC = float(os.getenv("MASHUP_MIN_TRACK_PADDING_SEC", "20"))
+# Any non-empty value makes the random pick repeatable across runs.
+SELECTION_SEED = os.getenv("MASHUP_SELECTION_SEED", "")
+
+BAD_KEYWORDS = [
+    "compilation", "jukebox", "nonstop", "non-stop", "non stop", "full album",
+    "hours", "1 hour", "2 hour", "live", "concert", "#shorts", "shorts",
+    "reaction", "karaoke", "interview", "teaser", "trailer", "mashup",
+] + [k.strip().lower() for k in os.getenv("MASHUP_BAD_KEYWORDS", "").split(",") if k.strip()]
+
+_BAD_RE = re.compile(r"(?<!\w)(" + "|".join(re.escape(k) for k in BAD_KEYWORDS) + r")(?!\w)")
+
+
+def reject_reason(entry: Dict, clip_sec: Optional[float]) -> Optional[str]:
+    duration = entry.get("duration")
+    if duration:
+        min_sec = (clip_sec or 0) + MIN_TRACK_PADDING_SEC
+        if duration < min_sec:
+            return f"too short ({duration:.0f}s)"
+        if duration > MAX_TRACK_SEC:
+            return f"too long ({duration:.0f}s)"
+
+    match = _BAD_RE.search((entry.get("title") or "").lower())
+    if match:
+        return f"keyword '{match.group(1)}'"
+    return None
+
+
+def score_entry(entry: Dict) -> float:
+    """Higher is better: typical song length, popularity, and a known duration"""
+    score = 0.0
+    duration = entry.get("duration")
+    if duration:
+        score += 2.0 if 150 <= duration <= 360 else 1.0
+    if entry.get("view_count"):
+        score += math.log10(entry["view_count"] + 1) / 3.0
+    if re.search(r"\b(official audio|audio)\b", (entry.get("title") or "").lower()):
+        score += 0.5
+    return score
+
+
+def rank_candidates(entries: List[Dict], clip_sec: Optional[float] = None) -> List[Dict]:
+    """Drop unusable entries and repeat recordings, best-scored first"""
+    kept: List[Dict] = []
+    for entry in entries:
+        reason = reject_reason(entry, clip_sec)
+        if reason:
+            print(f"Rejected candidate {entry.get('title')!r}: {reason}")
+            continue
+        kept.append(entry)
+
+    # Sort before deduping so the best-scored version of each song survives.
+    return dedupe_entries(sorted(kept, key=score_entry, reverse=True))
+
+
+def split_candidates(
+    entries: List[Dict],
+    n: int,
+    clip_sec: Optional[float] = None,
+    seed: Optional[str] = None,
+) -> Tuple[List[Dict], List[Dict]]:
+    """Randomly pick n from the better-ranked half; the rest (best first) is surplus.
+
+    With a seed (or MASHUP_SELECTION_SEED) the same entries always give the
+    same pick.
+    """
+    ranked = rank_candidates(entries, clip_sec)
+    if len(ranked) <= n:
+        return ranked, []
+    pool = ranked[:max(n, min(len(ranked), n * 2))]
+    seed = seed or SELECTION_SEED
+    selected = (random.Random(seed) if seed else random).sample(pool, n)
+    picked = {id(e) for e in selected}
+    return selected, [e for e in ranked if id(e) not in picked]
+
+
+def select_candidates(entries: List[Dict], n: int, clip_sec: Optional[float] = None, seed: Optional[str] = None) -> List[Dict]:
+    return split_candidates(entries, n, clip_sec, seed)[0]
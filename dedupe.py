@@ -0,0 +1,169 @@
+"""Duplicate-recording detection: title/duration before download, audio fingerprints after"""
+
+import re
+from difflib import SequenceMatcher
+from typing import Any, Callable, Dict, List, Sequence, Tuple
+
+import numpy as np
+from pydub import AudioSegment
+
+# Version markers that do not make a different song.
+_VERSION_WORDS = re.compile(
+    r"\b(official|music|lyric|lyrics|lyrical|video|audio|song|full|hd|hq|4k|"
+    r"visualizer|visualiser|slowed|reverb|sped|up|lofi|lo|fi|remastered|remaster|"
+    r"version|ver|feat|ft|with|original|new|latest|hindi|punjabi|english)\b"
+)
+
+TITLE_SIMILARITY = 0.88
+DURATION_TOLERANCE_SEC = 8.0
+
+FINGERPRINT_STEP_MS = 250
+FINGERPRINT_MIN_OVERLAP = 0.4
+FINGERPRINT_THRESHOLD = 0.85
+
+_SAMPLE_DTYPES = {1: np.int8, 2: np.int16, 4: np.int32}
+
+
+def recording_key(title: str) -> str:
+    """Title reduced to the song itself: no brackets, version words or punctuation"""
+    # "Song | Movie | Artist" style titles: the song comes first.
+    text = (title or "").lower().split("|")[0]
+    text = re.sub(r"[\(\[\{].*?[\)\]\}]", " ", text)
+    text = re.sub(r"[^\w\s]+", " ", text)
+    text = _VERSION_WORDS.sub(" ", text)
+    return " ".join(text.split())
+
+
+def same_recording(a: Dict, b: Dict) -> bool:
+    key_a, key_b = recording_key(a.get("title")), recording_key(b.get("title"))
+    if not key_a or not key_b:
+        return False
+    if key_a == key_b:
+        return True
+
+    dur_a, dur_b = a.get("duration"), b.get("duration")
+    durations_match = bool(dur_a and dur_b and abs(dur_a - dur_b) <= DURATION_TOLERANCE_SEC)
+    return durations_match and SequenceMatcher(None, key_a, key_b).ratio() >= TITLE_SIMILARITY
+
+
+def dedupe_entries(entries: List[Dict]) -> List[Dict]:
+    """Keep the first entry of every recording, preserving order"""
+    kept: List[Dict] = []
+    for entry in entries:
+        dup = next((k for k in kept if same_recording(entry, k)), None)
+        if dup:
+            print(f"Duplicate recording {entry.get('title')!r} ~ {dup.get('title')!r}")
+            continue
+        kept.append(entry)
+    return kept
+
+
+def clip_fingerprint(segment: AudioSegment, step_ms: int = FINGERPRINT_STEP_MS) -> np.ndarray:
+    """Standardized log-energy envelope of a decoded clip, one value per step_ms"""
+    mono = segment.set_channels(1)
+    if mono.sample_width not in _SAMPLE_DTYPES:
+        mono = mono.set_sample_width(2)
+    samples = np.frombuffer(mono.raw_data, dtype=_SAMPLE_DTYPES[mono.sample_width]).astype(np.float32)
+
+    # One reshape into step_ms blocks instead of slicing the segment per step.
+    step = max(1, mono.frame_rate * step_ms // 1000)
+    blocks = samples[:len(samples) // step * step].reshape(-1, step)
+    envelope = np.log10(np.sqrt(np.einsum("ij,ij->i", blocks, blocks) / step) + 1.0)
+    if len(envelope) < 2:
+        return envelope
+    return (envelope - envelope.mean()) / (envelope.std() or 1.0)
+
+
+def fingerprint_similarity(a: Sequence[float], b: Sequence[float]) -> float:
+    """Best correlation over lags that keep at least FINGERPRINT_MIN_OVERLAP of the shorter clip"""
+    a, b = np.asarray(a, dtype=np.float64), np.asarray(b, dtype=np.float64)
+    min_overlap = max(2, int(min(len(a), len(b)) * FINGERPRINT_MIN_OVERLAP))
+    if min(len(a), len(b)) < min_overlap:
+        return -1.0
+
+    # Every lag at once: cross sums from np.correlate, per-overlap sums and
+    # sums of squares from prefix sums, then Pearson's r for each overlap.
+    lags = np.arange(-(len(b) - 1), len(a))
+    start_a, start_b = np.maximum(lags, 0), np.maximum(-lags, 0)
+    count = np.minimum(len(a) - start_a, len(b) - start_b)
+    keep = count >= min_overlap
+    lags, start_a, start_b, count = lags[keep], start_a[keep], start_b[keep], count[keep]
+
+    def window_sums(x: np.ndarray, start: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        sums = np.concatenate(([0.0], np.cumsum(x)))
+        squares = np.concatenate(([0.0], np.cumsum(x * x)))
+        return sums[start + count] - sums[start], squares[start + count] - squares[start]
+
+    sum_x, sq_x = window_sums(a, start_a)
+    sum_y, sq_y = window_sums(b, start_b)
+    cross = np.correlate(a, b, mode="full")[lags + len(b) - 1]
+
+    cov = cross - sum_x * sum_y / count
+    var_x = sq_x - sum_x * sum_x / count
+    var_y = sq_y - sum_y * sum_y / count
+    valid = (var_x > 1e-12) & (var_y > 1e-12)
+    if not valid.any():
+        return -1.0
+    return float(np.max(cov[valid] / np.sqrt(var_x[valid] * var_y[valid])))
+
+
+def with_fingerprint(
+    prepare: Callable[[str], Any],
+    keep_clip: bool = True,
+) -> Callable[[str], Tuple[Any, np.ndarray]]:
+    """Pipeline prepare_fn that also fingerprints each decoded clip, once, as it lands.
+
+    With keep_clip=False the decoded audio is dropped right after
+    fingerprinting and the pair holds None, for merges that read the
+    trimmed files themselves.
+    """
+    def prepare_and_fingerprint(path: str) -> Tuple[Any, np.ndarray]:
+        clip = prepare(path)
+        fingerprint = clip_fingerprint(clip)
+        return (clip if keep_clip else None), fingerprint
+
+    return prepare_and_fingerprint
+
+
+def duplicate_clip_indexes(prints: List[np.ndarray]) -> List[int]:
+    """Indexes of clips whose fingerprint repeats an earlier clip's audio"""
+    duplicates: List[int] = []
+    for i in range(len(prints)):
+        for j in range(i):
+            if j in duplicates:
+                continue
+            if fingerprint_similarity(prints[j], prints[i]) >= FINGERPRINT_THRESHOLD:
+                duplicates.append(i)
+                break
+    return duplicates
+
+
+def replace_duplicate_clips(
+    trimmed: List[str],
+    clips: List[Tuple[Any, np.ndarray]],
+    refill: Callable[[List[str]], Tuple[List[str], List[Tuple[Any, np.ndarray]]]],
+    rounds: int = 2,
+) -> Tuple[List[str], List[Tuple[Any, np.ndarray]]]:
+    """Drop fingerprint duplicates and top up from refill(dropped_paths).
+
+    clips holds the (clip, fingerprint) pairs made by a with_fingerprint
+    prepare stage. refill receives the trimmed paths that were dropped and
+    returns freshly trimmed (paths, pairs) taken from the surplus candidates.
+    """
+    for _ in range(rounds):
+        drop = set(duplicate_clip_indexes([fingerprint for _, fingerprint in clips]))
+        if not drop:
+            break
+
+        dropped = [trimmed[i] for i in sorted(drop)]
+        print(f"Dropping {len(dropped)} duplicate clip(s): {', '.join(dropped)}")
+        trimmed = [t for i, t in enumerate(trimmed) if i not in drop]
+        clips = [c for i, c in enumerate(clips) if i not in drop]
+
+        new_trimmed, new_clips = refill(dropped)
+        if not new_trimmed:
+            break
+        trimmed += new_trimmed
+        clips += new_clips
+
+    return trimmed, clips
@@ -0,0 +1,168 @@
+"""Process-wide download governor: fair-shared slots and a bytes/sec token bucket"""
+
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional
+
+from fair_slots import FairSlots
+
+try:
+    import fcntl
+except Exception:
+    fcntl = None
+
+MAX_CONCURRENT_DOWNLOADS = max(1, int(os.getenv("MASHUP_MAX_CONCURRENT_DOWNLOADS", "8")))
+# 0 disables the bandwidth cap.
+DOWNLOAD_BPS = int(float(os.getenv("MASHUP_DOWNLOAD_MBPS", "0")) * 1024 * 1024 / 8)
+DOWNLOAD_BURST_SEC = float(os.getenv("MASHUP_DOWNLOAD_BURST_SEC", "2"))
+# Directory shared by several app processes; empty keeps the governor in-process.
+GOVERNOR_DIR = os.getenv("MASHUP_GOVERNOR_DIR", "")
+
+
+class TokenBucket:
+    """Classic token bucket: rate bytes/sec, capacity burst bytes"""
+
+    def __init__(self, rate: int, burst: int):
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self._tokens = float(self.burst)
+        self._stamp = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _take(self, count: int) -> float:
+        """Take up to count tokens, returning seconds to wait for the rest (0 when done)"""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._stamp) * self.rate)
+            self._stamp = now
+            if self._tokens >= count:
+                self._tokens -= count
+                return 0.0
+            return (count - self._tokens) / self.rate
+
+    def consume(self, count: int) -> None:
+        # Large progress deltas are paid for in burst-sized pieces so one
+        # chunk can never wait on more tokens than the bucket holds.
+        while count > 0:
+            piece = min(count, self.burst)
+            wait = self._take(piece)
+            if wait:
+                time.sleep(min(wait, 1.0))
+                continue
+            count -= piece
+
+
+class FileTokenBucket(TokenBucket):
+    """Token bucket whose state lives in a flock-guarded file shared across processes"""
+
+    def __init__(self, rate: int, burst: int, path: str):
+        super().__init__(rate, burst)
+        self.path = path
+
+    def _take(self, count: int) -> float:
+        with open(self.path, "a+") as fh:
+            fcntl.flock(fh, fcntl.LOCK_EX)
+            try:
+                fh.seek(0)
+                parts = fh.read().split()
+                now = time.time()
+                tokens, stamp = (float(parts[0]), float(parts[1])) if len(parts) == 2 else (self.burst, now)
+                tokens = min(self.burst, tokens + max(0.0, now - stamp) * self.rate)
+                wait = 0.0
+                if tokens >= count:
+                    tokens -= count
+                else:
+                    wait = (count - tokens) / self.rate
+                fh.seek(0)
+                fh.truncate()
+                fh.write(f"{tokens} {now}")
+                return wait
+            finally:
+                fcntl.flock(fh, fcntl.LOCK_UN)
+
+
+class DownloadGovernor:
+    """Hands out download slots fairly between jobs and paces their bytes.
+
+    A freed slot goes to the waiting job with the fewest downloads in flight
+    (oldest request first on ties), so one large job cannot starve the others.
+    With a shared directory, slots are also backed by flock'ed slot files and
+    the bucket by a shared state file, so several processes on one host obey
+    the same limits.
+    """
+
+    def __init__(self, slots: int = MAX_CONCURRENT_DOWNLOADS, bps: int = DOWNLOAD_BPS, shared_dir: str = GOVERNOR_DIR):
+        self.slots = max(1, slots)
+        self.shared_dir = shared_dir if shared_dir and fcntl else ""
+        if shared_dir and not fcntl:
+            print("Download governor: file locking unavailable, limits apply per process")
+        if self.shared_dir:
+            os.makedirs(self.shared_dir, exist_ok=True)
+
+        self.bucket: Optional[TokenBucket] = None
+        if bps > 0:
+            burst = int(bps * DOWNLOAD_BURST_SEC)
+            if self.shared_dir:
+                self.bucket = FileTokenBucket(bps, burst, os.path.join(self.shared_dir, "bandwidth"))
+            else:
+                self.bucket = TokenBucket(bps, burst)
+
+        self._slots = FairSlots(self.slots)
+
+    def _acquire_file_slot(self):
+        """Hold one of the shared slot files; polls because flock has no fair queue"""
+        while True:
+            for index in range(self.slots):
+                fh = open(os.path.join(self.shared_dir, f"slot-{index}.lock"), "w")
+                try:
+                    fcntl.flock(fh, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    return fh
+                except OSError:
+                    fh.close()
+            time.sleep(0.2)
+
+    @contextmanager
+    def slot(self, job: Optional[str] = None) -> Iterator[None]:
+        job = job or "default"
+        self._slots.acquire(job)
+        slot_file = None
+        try:
+            if self.shared_dir:
+                slot_file = self._acquire_file_slot()
+            yield
+        finally:
+            if slot_file:
+                fcntl.flock(slot_file, fcntl.LOCK_UN)
+                slot_file.close()
+            self._slots.release(job)
+
+    def progress_hook(self):
+        """yt-dlp progress hook that charges transferred bytes to the bucket.
+
+        Blocking inside the hook pauses that download between chunks, which
+        paces the transfer without letting sockets sit idle long enough to hit
+        socket_timeout.
+        """
+        seen = {"bytes": 0}
+
+        def hook(status: Dict) -> None:
+            done = status.get("downloaded_bytes") or 0
+            # Fragmented formats restart the counter per fragment.
+            delta = done - seen["bytes"] if done >= seen["bytes"] else done
+            seen["bytes"] = done
+            if delta > 0 and self.bucket:
+                self.bucket.consume(delta)
+
+        return hook
+
+    def stats(self) -> Dict:
+        stats = self._slots.stats()
+        stats.pop("wait_by_priority")
+        stats["bytes_per_sec_cap"] = self.bucket.rate if self.bucket else 0
+        stats["shared"] = bool(self.shared_dir)
+        return stats
+
+
+governor = DownloadGovernor()
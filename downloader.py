@@ -0,0 +1,265 @@
+"""Bounded-concurrency yt-dlp download engine shared by the mashup pipelines"""
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
+from yt_dlp import YoutubeDL
+from yt_dlp.utils import download_range_func
+from audio_cache import SourceCache, source_cache
+from download_governor import governor
+from envelope_cache import ENVELOPE_STEP_MS, envelope_cache, loudest_start_ms, remember_track, video_key
+from media_probe import info_duration, remember_duration
+from search_cache import search_cache, slim_entry
+
+DOWNLOAD_WORKERS = max(1, int(os.getenv("MASHUP_DOWNLOAD_WORKERS", "4")))
+AUDIO_MIN_ABR = int(os.getenv("MASHUP_AUDIO_MIN_ABR", "96"))
+PARTIAL_DOWNLOADS = os.getenv("MASHUP_PARTIAL_DOWNLOADS", "0") == "1"
+PARTIAL_MARGIN_SEC = float(os.getenv("MASHUP_PARTIAL_MARGIN_SEC", "5"))
+
+# Maps an entry to the (start, end) seconds worth fetching, or None for the whole track.
+RangeFn = Callable[[Dict], Optional[Tuple[float, float]]]
+
+
+def audio_format(min_abr: int = AUDIO_MIN_ABR) -> str:
+    """Format selector for the smallest audio-only stream that meets the bitrate floor.
+
+    Everything is re-encoded to MP3 later, so extra source bitrate is wasted
+    transfer. Falls back to the best audio-only stream below the floor, then to
+    the best muxed stream, and last to any format that carries audio
+    (bestaudio*, which may include video).
+    """
+    # worstaudio/bestaudio already mean audio-only (vcodec=none).
+    return (
+        f"worstaudio[abr>={min_abr}]"
+        "/bestaudio"
+        "/best"
+        "/bestaudio*"
+    )
+
+
+def build_ydl_opts(outtmpl: str) -> Dict:
+    """Common yt-dlp options used for both search and download"""
+    return {
+        "format": audio_format(),
+        "outtmpl": outtmpl,
+        "quiet": False,
+        "noplaylist": True,
+        "skip_unavailable_fragments": True,
+        "retries": 5,
+        "fragment_retries": 3,
+        "socket_timeout": 15,
+        "ignoreerrors": True,
+        "nocheckcertificate": True,
+        "extract_flat": False,
+        "match_filters": "!is_live & !is_upcoming",
+        "js_runtimes": {"node": {}},
+    }
+
+
+def mid_window(duration: Optional[float], clip_sec: float, margin: float = PARTIAL_MARGIN_SEC) -> Optional[Tuple[float, float]]:
+    """Time range around the middle clip, padded so trim_mid_chunk lands on the same audio"""
+    if not duration or duration <= clip_sec + 2 * margin:
+        return None
+    start = (duration - clip_sec) / 2.0 - margin
+    return start, start + clip_sec + 2 * margin
+
+
+def mid_range_fn(clip_sec: float) -> Optional[RangeFn]:
+    """RangeFn for the mid-trim path, or None when partial downloads are off"""
+    if not PARTIAL_DOWNLOADS:
+        return None
+    return lambda entry: mid_window(entry.get("duration"), clip_sec)
+
+
+def loudest_window(envelope, clip_sec: float, margin: float = PARTIAL_MARGIN_SEC) -> Optional[Tuple[float, float]]:
+    """Time range around the cached loudest clip, padded so the loudest trim finds it again"""
+    total = len(envelope) * ENVELOPE_STEP_MS / 1000.0
+    if total <= clip_sec + 2 * margin:
+        return None
+    start = loudest_start_ms(envelope, int(clip_sec * 1000)) / 1000.0
+    return max(0.0, start - margin), min(total, start + clip_sec + margin)
+
+
+def loudest_range_fn(clip_sec: float) -> Optional[RangeFn]:
+    """RangeFn for the loudest-window path, or None when partial downloads are off.
+
+    Only tracks with a cached loudness envelope can be fetched partially; the
+    rest are downloaded whole and their envelope is cached by the trim stage.
+    """
+    if not PARTIAL_DOWNLOADS:
+        return None
+
+    def window(entry: Dict) -> Optional[Tuple[float, float]]:
+        envelope = envelope_cache.get(video_key(entry.get("id")))
+        return loudest_window(envelope, clip_sec) if envelope is not None else None
+
+    return window
+
+
+def _flat_entry(entry: Dict) -> Dict:
+    """Fill the fields the pipeline reads from a flat (url-type) search result"""
+    entry = dict(entry)
+    if not entry.get("webpage_url"):
+        url = entry.get("url") or ""
+        if not url.startswith("http") and entry.get("id"):
+            url = f"https://www.youtube.com/watch?v={entry['id']}"
+        entry["webpage_url"] = url or None
+    if not entry.get("thumbnail") and entry.get("thumbnails"):
+        entry["thumbnail"] = entry["thumbnails"][-1].get("url")
+    if not entry.get("uploader"):
+        entry["uploader"] = entry.get("channel")
+    return entry
+
+
+def search_entries(ydl_opts: Dict, query: str, suffix: str, count: int) -> List[Dict]:
+    """Run a ytsearch for "<query> <suffix>", served from the TTL cache when possible"""
+    key = search_cache.make_key(query, suffix, count)
+    cached = search_cache.get(key)
+    if cached is not None:
+        print(f"Search cache hit: {query} {suffix} ({len(cached)} results)")
+        return cached
+
+    # Flat listing only: formats and signatures are resolved later, per selected
+    # entry, inside the download workers.
+    with YoutubeDL(dict(ydl_opts, extract_flat="in_playlist")) as ydl:
+        info = ydl.extract_info(f"ytsearch{count}:{query} {suffix}", download=False)
+
+    entries = [_flat_entry(e) for e in ((info or {}).get("entries") or []) if e]
+    # Slimmed the same way as cached results, so a miss and a hit look alike.
+    entries = [
+        slim_entry(e) for e in entries
+        if e.get("webpage_url") and e.get("live_status") not in ("is_live", "is_upcoming")
+    ]
+    search_cache.put(key, entries)
+    return entries
+
+
+def _downloaded_item(info: Dict) -> Dict:
+    """The requested_downloads entry that was written to disk (info itself for older yt-dlp)"""
+    for item in info.get("requested_downloads") or []:
+        if item.get("filepath"):
+            return item
+    return info
+
+
+def _downloaded_path(info: Dict) -> Optional[str]:
+    item = _downloaded_item(info)
+    return item.get("filepath") or item.get("_filename")
+
+
+def _download_one(
+    ydl_opts: Dict,
+    entry: Dict,
+    cache: Optional[SourceCache],
+    ranges: Optional[RangeFn],
+    job_id: Optional[str] = None,
+) -> Tuple[str, Dict]:
+    url = entry["webpage_url"]
+    # YoutubeDL instances are not thread-safe, so every worker gets its own.
+    opts = dict(ydl_opts, ignoreerrors=False)
+    opts["progress_hooks"] = list(ydl_opts.get("progress_hooks") or []) + [governor.progress_hook()]
+    window = ranges(entry) if ranges else None
+    if window:
+        opts["download_ranges"] = download_range_func(None, [window])
+    with YoutubeDL(opts) as ydl:
+        if cache and entry.get("id"):
+            dest_base = os.path.splitext(ydl.prepare_filename(entry))[0]
+            if path := cache.materialize(entry["id"], dest_base):
+                print(f"Source cache hit: {os.path.basename(path)}")
+                remember_duration(path, info_duration(entry))
+                remember_track(path, entry["id"])
+                return path, dict(entry, _cache_hit=True)
+
+        # Slots are shared fairly between jobs and paced by the governor's
+        # bandwidth bucket, across processes when MASHUP_GOVERNOR_DIR is set.
+        with governor.slot(job_id):
+            info = ydl.extract_info(url, download=True)
+
+    if not info:
+        raise RuntimeError("no info returned")
+
+    path = _downloaded_path(info)
+    if not path or not os.path.isfile(path):
+        raise RuntimeError("skipped by filters or nothing downloaded")
+
+    if window:
+        # yt-dlp sets the section only on the requested_downloads entry; copy it
+        # up so the duration memo and the job ledger see the partial length.
+        item = _downloaded_item(info)
+        info = dict(
+            info,
+            section_start=item.get("section_start", window[0]),
+            section_end=item.get("section_end", window[1]),
+        )
+
+    # The trim stage reads this instead of probing the file again.
+    remember_duration(path, info_duration(info))
+
+    # Partial files are only good for this clip length, so keep them out of the
+    # caches keyed by video ID.
+    if not window:
+        remember_track(path, info.get("id"))
+        if cache:
+            cache.insert(info.get("id"), path)
+    return path, info
+
+
+def network_bytes(downloaded: List[Tuple[str, Dict]]) -> int:
+    """Bytes actually fetched over the network (cache hits, local and resumed files excluded)"""
+    total = 0
+    for path, info in downloaded:
+        fetched = not (info.get("_cache_hit") or info.get("_local") or info.get("_resumed"))
+        if fetched and os.path.isfile(path):
+            total += os.path.getsize(path)
+    return total
+
+
+def download_entries(
+    entries: List[Dict],
+    ydl_opts: Dict,
+    max_workers: Optional[int] = None,
+    cache: Optional[SourceCache] = source_cache,
+    ranges: Optional[RangeFn] = None,
+    on_downloaded: Optional[Callable[[int, str, Dict], None]] = None,
+    job_id: Optional[str] = None,
+) -> Tuple[List[Tuple[str, Dict]], Dict[str, str]]:
+    """Download entries in parallel.
+
+    Returns the (path, info) pairs in entry order and a url -> error map for
+    tracks that failed, so one bad video never aborts the batch. Entries whose
+    video ID is in the source cache are linked from disk instead. When ranges
+    yields a window for an entry only that part of the track is fetched.
+    on_downloaded(index, path, info) fires from the worker as each track lands,
+    so later stages can start before the whole batch is done. job_id is the
+    fair-share key used by the download governor.
+    """
+    entries = [e for e in entries if e and e.get("webpage_url")]
+    urls = [e["webpage_url"] for e in entries]
+    if not urls:
+        return [], {}
+
+    workers = max(1, min(max_workers or DOWNLOAD_WORKERS, len(urls)))
+    downloaded: List[Tuple[str, Dict]] = []
+    failures: Dict[str, str] = {}
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(_download_one, ydl_opts, entry, cache, ranges, job_id) for entry in entries]
+        if on_downloaded:
+            def _notify(future, index):
+                if future.exception() is None:
+                    on_downloaded(index, *future.result())
+
+            for index, future in enumerate(futures):
+                future.add_done_callback(lambda f, i=index: _notify(f, i))
+        for url, future in zip(urls, futures):
+            try:
+                downloaded.append(future.result())
+            except Exception as e:
+                failures[url] = str(e)
+                print(f"Download failed for {url}: {e}")
+
+    print(
+        f"Downloaded {len(downloaded)}/{len(urls)} tracks ({workers} workers, "
+        f"{network_bytes(downloaded) / (1024 * 1024):.1f} MB transferred)"
+    )
+    return downloaded, failures
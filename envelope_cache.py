@@ -0,0 +1,112 @@
+"""Persistent per-track loudness envelopes, so loudest windows are picked without decoding"""
+
+import os
+import re
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+import numpy as np
+
+from audio_cache import CACHE_DIR, evict_oldest
+
+ENVELOPE_RATE_HZ = 10
+ENVELOPE_STEP_MS = 1000 // ENVELOPE_RATE_HZ
+ENVELOPE_CACHE_MAX_MB = float(os.getenv("MASHUP_ENVELOPE_CACHE_MAX_MB", "64"))
+TRACK_MEMO_SIZE = 4096
+
+
+def loudest_start_ms(energies: np.ndarray, window_ms: int, step_ms: int = ENVELOPE_STEP_MS) -> int:
+    """Start of the window_ms span with the most energy (first on ties)"""
+    width = max(1, window_ms // step_ms)
+    if len(energies) < width:
+        return 0
+    prefix = np.concatenate(([0.0], np.cumsum(energies, dtype=np.float64)))
+    return int(np.argmax(prefix[width:] - prefix[:-width])) * step_ms
+
+
+class EnvelopeCache:
+    """Mean-square energy per 100 ms, stored as float16 log10 values (~6 KB per 5-minute track).
+
+    Files are named by track key, so a lookup is a single open; mtime is the
+    last-used stamp and the oldest files are evicted past max_bytes.
+    """
+
+    def __init__(self, root: str, max_bytes: int):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.enabled = max_bytes > 0
+        self._lock = threading.Lock()
+        if self.enabled:
+            os.makedirs(self.root, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.root, re.sub(r"[^A-Za-z0-9_-]", "_", key) + ".npy")
+
+    def get(self, key: Optional[str]) -> Optional[np.ndarray]:
+        if not self.enabled or not key:
+            return None
+        path = self._path(key)
+        try:
+            stored = np.load(path)
+            os.utime(path)
+        except (OSError, ValueError):
+            return None
+        return np.power(10.0, stored.astype(np.float64)) - 1.0
+
+    def put(self, key: Optional[str], energies: np.ndarray) -> None:
+        if not self.enabled or not key or not len(energies):
+            return
+        stored = np.log10(np.asarray(energies, dtype=np.float64) + 1.0).astype(np.float16)
+        fd, tmp_path = tempfile.mkstemp(dir=self.root, suffix=".part")
+        try:
+            with os.fdopen(fd, "wb") as fh:
+                np.save(fh, stored)
+            os.replace(tmp_path, self._path(key))
+        except OSError as e:
+            print(f"Warning: Envelope cache write failed for {key}: {e}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return
+        self.evict()
+
+    def evict(self) -> None:
+        with self._lock:
+            evict_oldest(self.root, self.max_bytes, lambda name: name.endswith(".npy"))
+
+
+envelope_cache = EnvelopeCache(
+    os.path.join(CACHE_DIR, "envelopes"),
+    int(ENVELOPE_CACHE_MAX_MB * 1024 * 1024),
+)
+
+# Files known to hold a complete source track, keyed by path.
+_track_ids: "OrderedDict[str, str]" = OrderedDict()
+_track_lock = threading.Lock()
+
+
+def video_key(video_id: Optional[str]) -> Optional[str]:
+    return f"id-{video_id}" if video_id else None
+
+
+def remember_track(path: str, video_id: Optional[str]) -> None:
+    """Record that path is the full audio of video_id, so its envelope is shared by ID"""
+    if not video_id:
+        return
+    with _track_lock:
+        _track_ids[path] = video_id
+        _track_ids.move_to_end(path)
+        while len(_track_ids) > TRACK_MEMO_SIZE:
+            _track_ids.popitem(last=False)
+
+
+def track_key(path: str) -> Optional[str]:
+    """Video ID key when the file is a known full track, otherwise None.
+
+    Partial downloads and unknown files would only ever match themselves, so
+    they are neither looked up nor cached.
+    """
+    with _track_lock:
+        video_id = _track_ids.get(path)
+    return video_key(video_id)
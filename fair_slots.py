@@ -0,0 +1,98 @@
+"""Fair-share slot allocation between jobs, with priorities and queue-wait metrics"""
+
+import itertools
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional
+
+# A waiter gains one priority level for every this many seconds spent queued.
+AGING_SEC = 5.0
+
+
+class FairSlots:
+    """A counting semaphore that picks who goes next.
+
+    A freed slot goes to the waiter with the best (lowest) priority, then to
+    the job with the fewest slots in use, then to the oldest request, so one
+    large job cannot starve the others. Waiting time slowly raises a
+    request's priority (up to 0, the top level) so low-priority work still
+    gets through under load.
+    """
+
+    def __init__(self, slots: int, aging_sec: float = AGING_SEC):
+        self.slots = max(1, slots)
+        self.aging_sec = aging_sec
+        self._cond = threading.Condition()
+        self._active: Dict[str, int] = {}
+        self._waiting: List[tuple] = []
+        self._seq = itertools.count()
+        self._in_use = 0
+        self._waits: Dict[int, List[float]] = {}
+
+    def _rank(self, ticket: tuple, now: float) -> tuple:
+        seq, job, priority, queued = ticket
+        if self.aging_sec and priority > 0:
+            # Aging stops at the top level, where per-job fairness decides.
+            priority = max(0, priority - int((now - queued) / self.aging_sec))
+        return priority, self._active.get(job, 0), seq
+
+    def acquire(self, job: str = "default", priority: int = 0) -> None:
+        ticket = (next(self._seq), job, priority, time.monotonic())
+        with self._cond:
+            self._waiting.append(ticket)
+            while True:
+                if self._in_use < self.slots:
+                    now = time.monotonic()
+                    if min(self._waiting, key=lambda w: self._rank(w, now)) is ticket:
+                        break
+                # Time out now and then so aging can reorder the queue.
+                self._cond.wait(timeout=self.aging_sec if priority > 0 and self.aging_sec else None)
+            self._waiting.remove(ticket)
+            self._in_use += 1
+            self._active[job] = self._active.get(job, 0) + 1
+
+            stats = self._waits.setdefault(priority, [0, 0.0, 0.0])
+            waited = time.monotonic() - ticket[3]
+            stats[0] += 1
+            stats[1] += waited
+            stats[2] = max(stats[2], waited)
+            # Another slot may still be free for the next waiter in line.
+            self._cond.notify_all()
+
+    def release(self, job: str = "default") -> None:
+        with self._cond:
+            self._in_use -= 1
+            self._active[job] -= 1
+            if not self._active[job]:
+                del self._active[job]
+            self._cond.notify_all()
+
+    @contextmanager
+    def slot(self, job: Optional[str] = None, priority: int = 0) -> Iterator[None]:
+        job = job or "default"
+        self.acquire(job, priority)
+        try:
+            yield
+        finally:
+            self.release(job)
+
+    def stats(self) -> Dict:
+        with self._cond:
+            granted = sum(s[0] for s in self._waits.values())
+            total_wait = sum(s[1] for s in self._waits.values())
+            return {
+                "slots": self.slots,
+                "in_use": self._in_use,
+                "waiting": len(self._waiting),
+                "active_by_job": dict(self._active),
+                "avg_wait_sec": round(total_wait / granted, 3) if granted else 0.0,
+                "wait_by_priority": {
+                    priority: {
+                        "granted": count,
+                        "avg_wait_sec": round(total / count, 3) if count else 0.0,
+                        "max_wait_sec": round(longest, 3),
+                    }
+                    for priority, (count, total, longest) in sorted(self._waits.items())
+                },
+            }
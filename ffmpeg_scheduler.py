@@ -0,0 +1,58 @@
+"""Process-wide scheduler that every ffmpeg/ffprobe invocation goes through"""
+
+import contextvars
+import os
+import subprocess
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+
+from fair_slots import FairSlots
+
+FFMPEG_SLOTS = max(1, int(os.getenv("MASHUP_FFMPEG_SLOTS", str(os.cpu_count() or 2))))
+
+# Lower runs first: finishing a job's merge beats starting another job's trims.
+PRIORITY_MERGE = 0
+PRIORITY_PROBE = 1
+PRIORITY_DECODE = 2
+PRIORITY_TRIM = 3
+PRIORITY_NAMES = {
+    PRIORITY_MERGE: "merge",
+    PRIORITY_PROBE: "probe",
+    PRIORITY_DECODE: "decode",
+    PRIORITY_TRIM: "trim",
+}
+
+_slots = FairSlots(FFMPEG_SLOTS)
+_current_job: contextvars.ContextVar = contextvars.ContextVar("ffmpeg_job", default="default")
+
+
+@contextmanager
+def job_scope(job_id: Optional[str]) -> Iterator[None]:
+    """Charge ffmpeg work started in this context (and threads copying it) to job_id"""
+    token = _current_job.set(job_id or "default")
+    try:
+        yield
+    finally:
+        _current_job.reset(token)
+
+
+@contextmanager
+def ffmpeg_slot(priority: int = PRIORITY_TRIM) -> Iterator[None]:
+    """Hold one ffmpeg slot for the current job; wrap Popen or pydub calls that spawn ffmpeg"""
+    with _slots.slot(_current_job.get(), priority):
+        yield
+
+
+def run_ffmpeg(cmd: List[str], priority: int = PRIORITY_TRIM, **kwargs: Any) -> subprocess.CompletedProcess:
+    """subprocess.run for ffmpeg/ffprobe, started once a slot is free"""
+    with ffmpeg_slot(priority):
+        return subprocess.run(cmd, **kwargs)
+
+
+def ffmpeg_stats() -> Dict:
+    stats = _slots.stats()
+    stats["wait_by_priority"] = {
+        PRIORITY_NAMES.get(priority, str(priority)): waits
+        for priority, waits in stats["wait_by_priority"].items()
+    }
+    return stats
@@ -0,0 +1,165 @@
+"""Per-job workspace, output paths and session state"""
+
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from typing import IO, Any, Dict, List, Optional
+
+from job_ledger import LEDGER_NAME, JobLedger, job_key
+
+try:
+    import fcntl
+except Exception:
+    fcntl = None
+
+DOWNLOAD_DIR = "downloads"
+TRIM_DIR = "trimmed"
+JOBS_DIR = os.getenv("MASHUP_JOBS_DIR", os.path.join(tempfile.gettempdir(), "aantre-jobs"))
+# Resumable workspaces untouched for this long are removed.
+JOB_RESUME_TTL = float(os.getenv("MASHUP_JOB_RESUME_TTL", "86400"))
+# Held (flock) by the process running a resumable job, for as long as it runs.
+LOCK_NAME = "job.lock"
+
+# Keys of resumable jobs currently running in this process.
+_RUNNING: set = set()
+_RUNNING_LOCK = threading.Lock()
+
+
+class JobContext:
+    """Everything one mashup job writes or remembers.
+
+    JobContext() keeps the historical shared layout (downloads/, trimmed/ and
+    result.* in the working directory) for the CLI. JobContext.create() gives
+    the job a private temp workspace so many jobs can run in one process.
+    JobContext.resumable() derives the workspace from the job parameters and
+    keeps a JobLedger there, so retrying the same job picks up its artifacts.
+    """
+
+    def __init__(self, workspace: str = ".", job_id: Optional[str] = None, isolated: bool = False):
+        self.job_id = job_id or uuid.uuid4().hex[:12]
+        self.workspace = workspace
+        self.isolated = isolated
+        self.download_dir = DOWNLOAD_DIR if workspace == "." else os.path.join(workspace, DOWNLOAD_DIR)
+        self.trim_dir = TRIM_DIR if workspace == "." else os.path.join(workspace, TRIM_DIR)
+        self.output_path = os.path.join(workspace, "result.mp3") if isolated else "result.mp3"
+        self.zip_path = os.path.join(workspace, "result.zip") if isolated else "result.zip"
+        self.session_id = None
+        self.artist_info: Dict[str, str] = {}
+        self.bytes_downloaded = 0
+        # Ranked candidates that were not picked, per query, for replacing duplicates.
+        self.surplus: Dict[str, List[Dict]] = {}
+        self.ledger: Optional[JobLedger] = None
+        self._lock = threading.Lock()
+        self._lock_file: Optional[IO] = None
+
+    @classmethod
+    def create(cls, root: str = JOBS_DIR) -> "JobContext":
+        os.makedirs(root, exist_ok=True)
+        job_id = uuid.uuid4().hex[:12]
+        workspace = tempfile.mkdtemp(prefix=f"job-{job_id}-", dir=root)
+        return cls(workspace, job_id=job_id, isolated=True)
+
+    @classmethod
+    def resumable(cls, *params: Any, root: str = JOBS_DIR) -> "JobContext":
+        """Workspace keyed by the job parameters, resumed if a previous attempt left one.
+
+        A job already running in this or another process keeps its workspace;
+        the caller gets a fresh create() one instead.
+        """
+        key = job_key(*params)
+        with _RUNNING_LOCK:
+            if key in _RUNNING:
+                # The same job is already running here; do not share its files.
+                return cls.create(root)
+            _RUNNING.add(key)
+
+        prune_stale_jobs(root)
+        workspace = os.path.join(root, f"job-{key}")
+        os.makedirs(workspace, exist_ok=True)
+        lock_file = _lock_workspace(workspace)
+        if lock_file is None:
+            # Another process (worker) is running the same job.
+            with _RUNNING_LOCK:
+                _RUNNING.discard(key)
+            return cls.create(root)
+
+        ctx = cls(workspace, job_id=key, isolated=True)
+        ctx._lock_file = lock_file
+        ctx.ledger = JobLedger(os.path.join(workspace, LEDGER_NAME))
+        saved = ctx.ledger.session()
+        ctx.session_id = saved.get("session_id")
+        ctx.artist_info = saved.get("artist_info") or {}
+        return ctx
+
+    def release(self) -> None:
+        """Let another request resume this job's workspace"""
+        if self._lock_file:
+            # Closing the file drops the flock.
+            self._lock_file.close()
+            self._lock_file = None
+        with _RUNNING_LOCK:
+            _RUNNING.discard(self.job_id)
+
+    def add_downloaded_bytes(self, count: int) -> None:
+        with self._lock:
+            self.bytes_downloaded += count
+
+    def prepare(self) -> None:
+        """Create the job directories; the shared layout is wiped first"""
+        for path in (self.download_dir, self.trim_dir):
+            if not self.isolated and os.path.exists(path):
+                for attempt in range(3):
+                    try:
+                        shutil.rmtree(path)
+                        break
+                    except PermissionError:
+                        if attempt == 2:
+                            print(f"Warning: Using existing {path} due to access permissions.")
+            os.makedirs(path, exist_ok=True)
+
+    def cleanup(self) -> None:
+        """Remove an isolated workspace and everything in it"""
+        if self.isolated:
+            shutil.rmtree(self.workspace, ignore_errors=True)
+        self.release()
+
+
+def _lock_workspace(workspace: str) -> Optional[IO]:
+    """Open and flock the workspace's lock file; None if another process holds it"""
+    fh = open(os.path.join(workspace, LOCK_NAME), "w")
+    if not fcntl:
+        # No file locking here; only the in-process guard applies.
+        return fh
+    try:
+        fcntl.flock(fh, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return fh
+    except OSError:
+        fh.close()
+        return None
+
+
+def prune_stale_jobs(root: str = JOBS_DIR, max_age: float = JOB_RESUME_TTL) -> None:
+    """Remove job workspaces (and their ledgers) untouched for max_age seconds"""
+    if not os.path.isdir(root):
+        return
+    cutoff = time.time() - max_age
+    for entry in os.scandir(root):
+        if not entry.is_dir() or not entry.name.startswith("job-"):
+            continue
+        ledger_path = os.path.join(entry.path, LEDGER_NAME)
+        stamp_path = ledger_path if os.path.exists(ledger_path) else entry.path
+        with _RUNNING_LOCK:
+            running = entry.name[len("job-"):] in _RUNNING
+        if running or os.path.getmtime(stamp_path) >= cutoff:
+            continue
+        try:
+            lock_file = _lock_workspace(entry.path)
+        except OSError:
+            continue
+        if lock_file is None:
+            continue
+        shutil.rmtree(entry.path, ignore_errors=True)
+        lock_file.close()
@@ -0,0 +1,172 @@
+"""Per-job ledger of finished stages so a retried job resumes where it stopped"""
+
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from media_probe import info_duration, remember_duration
+
+LEDGER_NAME = "ledger.json"
+LEDGER_VERSION = 1
+
+
+def job_key(*parts: Any) -> str:
+    """Stable id for a job's parameters, so the same request maps to the same ledger"""
+    blob = json.dumps(parts, sort_keys=True, default=str).lower()
+    return hashlib.sha1(blob.encode("utf-8")).hexdigest()[:16]
+
+
+def track_key(entry: Dict, query: str = "") -> str:
+    """Ledger key of a track; scoped by query, since each query downloads its own copy"""
+    key = entry.get("id") or entry.get("webpage_url") or entry.get("title") or ""
+    return f"{query}|{key}" if query else key
+
+
+class JobLedger:
+    """JSON record of what a job has finished, written after every step.
+
+    Per query it keeps the search selection (and surplus); per track the
+    downloaded file, its probed duration and the trimmed clip; per output
+    whether the merge completed, plus the session id and artist info of the
+    run that merged it. Artifacts are only trusted while the files
+    still exist, so a half-cleaned workspace simply redoes the missing steps.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._data: Dict[str, Any] = {"version": LEDGER_VERSION, "searches": {}, "tracks": {}, "trims": {}, "merged": []}
+        try:
+            with open(path, "r", encoding="utf-8") as fh:
+                data = json.load(fh)
+            if data.get("version") == LEDGER_VERSION:
+                self._data.update(data)
+        except (OSError, ValueError):
+            pass
+
+    def _save(self) -> None:
+        self._data["updated"] = time.time()
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(self.path) or ".", suffix=".part")
+        with os.fdopen(fd, "w", encoding="utf-8") as fh:
+            json.dump(self._data, fh)
+        os.replace(tmp, self.path)
+
+    def selection(self, query: str) -> Optional[Tuple[List[Dict], List[Dict]]]:
+        with self._lock:
+            found = self._data["searches"].get(query)
+        return (found["selected"], found["surplus"]) if found else None
+
+    def record_selection(self, query: str, selected: List[Dict], surplus: List[Dict]) -> None:
+        with self._lock:
+            self._data["searches"][query] = {"selected": selected, "surplus": surplus}
+            self._save()
+
+    def downloaded(self, entry: Dict, query: str = "") -> Optional[Tuple[str, Dict]]:
+        with self._lock:
+            track = self._data["tracks"].get(track_key(entry, query))
+        if track and os.path.isfile(track["path"]):
+            remember_duration(track["path"], track.get("duration"))
+            return track["path"], dict(entry, _resumed=True)
+        return None
+
+    def record_download(self, entry: Dict, path: str, info: Dict, query: str = "") -> None:
+        with self._lock:
+            self._data["tracks"][track_key(entry, query)] = {
+                "path": path,
+                # Probed length of the source file, reused by the trim stage.
+                "duration": info_duration(info),
+            }
+            self._save()
+
+    def trimmed(self, path: str) -> Optional[str]:
+        with self._lock:
+            out_path = self._data["trims"].get(path)
+        return out_path if out_path and os.path.isfile(out_path) else None
+
+    def record_trim(self, path: str, out_path: str) -> None:
+        with self._lock:
+            self._data["trims"][path] = out_path
+            self._save()
+
+    def merged(self, output: str) -> bool:
+        with self._lock:
+            return output in self._data["merged"] and os.path.isfile(output)
+
+    def record_merge(self, output: str, session_id: Any = None, artist_info: Optional[Dict] = None) -> None:
+        """Mark output merged, with the session it was stored under for a resumed caller"""
+        with self._lock:
+            if output not in self._data["merged"]:
+                self._data["merged"].append(output)
+            self._data["session"] = {
+                # MongoDB ObjectIds are stored as their hex string.
+                "session_id": str(session_id) if session_id else None,
+                "artist_info": artist_info or {},
+            }
+            self._save()
+
+    def session(self) -> Dict:
+        with self._lock:
+            return dict(self._data.get("session") or {})
+
+    def trim_step(self, trim_fn: Callable[[str], str]) -> Callable[[str], str]:
+        """Wrap a trim function so clips already trimmed by an earlier attempt are reused"""
+        def run(path: str) -> str:
+            out_path = self.trimmed(path)
+            if out_path:
+                print(f"Resumed trim: {os.path.basename(out_path)}")
+                return out_path
+            out_path = trim_fn(path)
+            self.record_trim(path, out_path)
+            return out_path
+        return run
+
+
+def download_with_ledger(
+    source: Any,
+    entries: List[Dict],
+    outtmpl: str,
+    ledger: Optional[JobLedger] = None,
+    on_downloaded: Optional[Callable[[int, str, Dict], None]] = None,
+    query: str = "",
+    **kwargs: Any,
+) -> Tuple[List[Tuple[str, Dict]], Dict[str, str]]:
+    """MediaSource.download that skips tracks the ledger already has on disk.
+
+    Resumed tracks are reported through on_downloaded first (their info has
+    _resumed=True); the rest are downloaded and recorded as they land.
+    Tracks are looked up per query, so two queries that pick the same video
+    never share (and trim) one file. Results keep entry order.
+    """
+    if not ledger:
+        return source.download(entries, outtmpl, on_downloaded=on_downloaded, **kwargs)
+
+    done: Dict[int, Tuple[str, Dict]] = {}
+    pending: List[int] = []
+    for index, entry in enumerate(entries):
+        found = ledger.downloaded(entry, query)
+        if found:
+            done[index] = found
+            if on_downloaded:
+                on_downloaded(index, *found)
+        else:
+            pending.append(index)
+    if done:
+        print(f"Resumed {len(done)}/{len(entries)} downloads from the job ledger")
+
+    lock = threading.Lock()
+
+    def landed(i: int, path: str, info: Dict) -> None:
+        ledger.record_download(entries[pending[i]], path, info, query)
+        with lock:
+            done[pending[i]] = (path, info)
+        if on_downloaded:
+            on_downloaded(pending[i], path, info)
+
+    failures: Dict[str, str] = {}
+    if pending:
+        _, failures = source.download([entries[i] for i in pending], outtmpl, on_downloaded=landed, **kwargs)
+    return [done[i] for i in sorted(done)], failures
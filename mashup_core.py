@@ -1,88 +1,147 @@
 import sys
 import os
-import shutil
-import random
-from yt_dlp import YoutubeDL
-from advanced_mashup import trim_all_mid, merge_with_crossfade
+from advanced_mashup import (
+    MERGE_BACKEND,
+    ensure_ffmpeg_tools,
+    load_clip,
+    merge_prepared,
+    merge_with_crossfade,
+    prepare_clip,
+    trim_one_mid,
+)
+from candidates import split_candidates
+from dedupe import replace_duplicate_clips, with_fingerprint
+from downloader import mid_range_fn, network_bytes
+from ffmpeg_scheduler import job_scope
+from job_context import JobContext
+from job_ledger import download_with_ledger
+from media_source import default_source
 from mongodb_helper import mongo_handler
+from pipeline import StreamingPipeline
 
-DOWNLOAD_DIR = "downloads"
-TRIM_DIR = "trimmed"
-ARTIST_INFO = {}
-CURRENT_SESSION_ID = None
-
-def prepare_dirs():
+def prepare_dirs(ctx=None):
     """Efficiently clear and recreate directories with retry logic"""
-    for path in (DOWNLOAD_DIR, TRIM_DIR):
-        if os.path.exists(path):
-            for attempt in range(3):
-                try:
-                    shutil.rmtree(path)
-                    break
-                except PermissionError:
-                    if attempt == 2:
-                        print(f"Warning: Using existing {path} due to access permissions.")
-        os.makedirs(path, exist_ok=True)
-
-def download_videos(singer, n):
-    """Download videos with optimized search and storage"""
+    (ctx or JobContext()).prepare()
+
+def download_videos(singer, n, workers=None, clip_sec=None, on_downloaded=None, ctx=None, source=None):
+    """Download videos with optimized search and parallel downloads"""
+    ctx = ctx or JobContext()
+    source = source or default_source()
     print(f"\nDownloading top {n} videos for: {singer}")
 
-    before_files = {entry.name for entry in os.scandir(DOWNLOAD_DIR)} if os.path.exists(DOWNLOAD_DIR) else set()
-
-    ydl_opts = {
-        "format": "bestaudio/best",
-        "outtmpl": f"{DOWNLOAD_DIR}/%(title)s.%(ext)s",
-        "quiet": False,
-        "noplaylist": True,
-        "skip_unavailable_fragments": True,
-        "retries": 5,
-        "fragment_retries": 3,
-        "socket_timeout": 15,
-        "ignoreerrors": True,
-        "nocheckcertificate": True,
-        "extract_flat": False,
-        "match_filters": "!is_live & !is_upcoming",
-        "js_runtimes": {"node": {}},
+    resumed = ctx.ledger.selection(singer) if ctx.ledger else None
+    if resumed:
+        print("Resumed search selection from the job ledger")
+        selected, ctx.surplus[singer] = resumed
+    else:
+        entries = source.search(singer, "songs", n * 3)
+
+        if not entries:
+            raise RuntimeError("No videos found for the artist.")
+
+        selected, ctx.surplus[singer] = split_candidates(entries, n, clip_sec, source.selection_seed)
+        if selected and ctx.ledger:
+            ctx.ledger.record_selection(singer, selected, ctx.surplus[singer])
+    if not selected:
+        raise RuntimeError("No usable videos found for the artist.")
+
+    ctx.artist_info = {
+        "thumbnail": selected[0].get("thumbnail", ""),
+        "title": selected[0].get("title", singer),
+        "uploader": selected[0].get("uploader", singer),
     }
+    print(f"Artist info captured: {ctx.artist_info['title']}")
+
+    return download_selected(singer, selected, workers, clip_sec, on_downloaded, ctx, source)
+
+def download_selected(singer, selected, workers=None, clip_sec=None, on_downloaded=None, ctx=None, source=None):
+    """Download already-chosen entries into the job's download dir"""
+    ctx = ctx or JobContext()
+    source = source or default_source()
+    ranges = mid_range_fn(clip_sec) if clip_sec else None
+    downloaded, _ = download_with_ledger(
+        source,
+        selected,
+        f"{ctx.download_dir}/%(title)s.%(ext)s",
+        ctx.ledger,
+        max_workers=workers,
+        ranges=ranges,
+        on_downloaded=on_downloaded,
+        query=singer,
+        job_id=ctx.job_id,
+    )
+    paths = [path for path, _ in downloaded]
+    ctx.add_downloaded_bytes(network_bytes(downloaded))
+
+    if mongo_handler.connected and ctx.session_id:
+        for path in paths:
+            mongo_handler.store_song(
+                path,
+                singer,
+                ctx.session_id,
+                file_type="download",
+            )
 
-    query = f"ytsearch{n * 3}:{singer} songs"
+    return paths
 
-    with YoutubeDL(ydl_opts) as ydl:
-        info = ydl.extract_info(query, download=False)
+def download_and_trim(singer, n, duration, ctx=None, source=None):
+    """Trim each track as soon as it downloads and decode (or only fingerprint) clips as they land"""
+    ctx = ctx or JobContext()
+    ensure_ffmpeg_tools()
 
-        entries = [e for e in (info.get("entries") or []) if e and e.get("webpage_url")]
-        
-        if not entries:
-            raise RuntimeError("No videos found for the artist.")
+    def trim(path):
+        return trim_one_mid(path, duration, ctx)
 
-        selected = random.sample(entries, min(n, len(entries))) if len(entries) > n else entries
-
-        global ARTIST_INFO
-        ARTIST_INFO = {
-            "thumbnail": selected[0].get("thumbnail", ""),
-            "title": selected[0].get("title", singer),
-            "uploader": selected[0].get("uploader", singer),
-        }
-        print(f"Artist info captured: {ARTIST_INFO['title']}")
-
-        for entry in selected:
-            if url := entry.get("webpage_url"):
-                ydl.download([url])
-
-        if mongo_handler.connected and CURRENT_SESSION_ID and os.path.exists(DOWNLOAD_DIR):
-            after_files = {entry.name for entry in os.scandir(DOWNLOAD_DIR) if entry.is_file()}
-            new_files = after_files - before_files
-            for name in new_files:
-                path = os.path.join(DOWNLOAD_DIR, name)
-                if not os.path.isfile(path):
-                    continue
-                mongo_handler.store_song(
-                    path,
-                    singer,
-                    CURRENT_SESSION_ID,
-                    file_type="download",
-                )
+    if ctx.ledger:
+        trim = ctx.ledger.trim_step(trim)
+    if MERGE_BACKEND in ("ffmpeg", "stream"):
+        # These merges read the trimmed files; decode only to fingerprint.
+        prepare = with_fingerprint(load_clip, keep_clip=False)
+    else:
+        prepare = with_fingerprint(prepare_clip)
+    pipeline = StreamingPipeline(f"mashup:{ctx.job_id}", trim, prepare, job_id=ctx.job_id)
+    try:
+        download_videos(
+            singer,
+            n,
+            clip_sec=duration,
+            on_downloaded=lambda index, path, info: pipeline.submit(index, path),
+            ctx=ctx,
+            source=source,
+        )
+    finally:
+        trimmed, prepared = pipeline.finish()
+
+    def refill(dropped):
+        # Same-song uploads with different titles only show up once decoded;
+        # swap them for the next-best candidates that were not picked.
+        take = ctx.surplus.get(singer, [])[:len(dropped)]
+        ctx.surplus[singer] = ctx.surplus.get(singer, [])[len(take):]
+        if not take:
+            return [], []
+        refill_pipeline = StreamingPipeline(f"mashup-refill:{ctx.job_id}", trim, prepare, job_id=ctx.job_id)
+        try:
+            download_selected(
+                singer,
+                take,
+                clip_sec=duration,
+                on_downloaded=lambda index, path, info: refill_pipeline.submit(index, path),
+                ctx=ctx,
+                source=source,
+            )
+        finally:
+            refilled = refill_pipeline.finish()
+        return refilled
+
+    trimmed, prepared = replace_duplicate_clips(trimmed, prepared, refill)
+    return trimmed, [clip for clip, _ in prepared]
+
+def merge_clips(trimmed, clips, output):
+    """Merge with the configured backend; the ffmpeg and stream backends read the trimmed files themselves"""
+    if MERGE_BACKEND in ("ffmpeg", "stream"):
+        merge_with_crossfade(trimmed, output)
+    else:
+        merge_prepared(clips, output)
 
 def validate_args(args):
     if len(args) != 5:
@@ -122,30 +181,33 @@ def main():
     output = sys.argv[4]
 
     try:
-        prepare_dirs()
-        download_videos(singer, n)
-        trimmed = trim_all_mid(duration)
-        merge_with_crossfade(trimmed, output)
+        ctx = JobContext()
+        ctx.prepare()
+        trimmed, clips = download_and_trim(singer, n, duration, ctx)
+        merge_clips(trimmed, clips, output)
         print("\nMashup completed successfully")
     except Exception as e:
         print(f"\nError occurred: {e}")
         
 
-def run_mashup(singer, n, duration, output, user_email=None):
+def run_mashup(singer, n, duration, output, user_email=None, ctx=None, source=None):
     """Main mashup generation function with MongoDB integration"""
-    global CURRENT_SESSION_ID
-    
+    ctx = ctx or JobContext()
+    if ctx.ledger and ctx.ledger.merged(output):
+        print(f"Job {ctx.job_id} already merged, reusing {output}")
+        return ctx.session_id
+
     if mongo_handler.connected and user_email:
-        CURRENT_SESSION_ID = mongo_handler.start_new_session(singer, user_email)
+        ctx.session_id = mongo_handler.start_new_session(singer, user_email)
     
-    prepare_dirs()
-    download_videos(singer, n)
-    trimmed = trim_all_mid(duration)
+    ctx.prepare()
+    trimmed, clips = download_and_trim(singer, n, duration, ctx, source)
+    print(f"Job {ctx.job_id} downloaded {ctx.bytes_downloaded / (1024 * 1024):.1f} MB")
 
-    if mongo_handler.connected and CURRENT_SESSION_ID:
+    if mongo_handler.connected and ctx.session_id:
         downloads_by_base = {}
-        if os.path.exists(DOWNLOAD_DIR):
-            for entry in os.scandir(DOWNLOAD_DIR):
+        if os.path.exists(ctx.download_dir):
+            for entry in os.scandir(ctx.download_dir):
                 if not entry.is_file():
                     continue
                 base_name, _ = os.path.splitext(entry.name)
@@ -158,17 +220,20 @@ def run_mashup(singer, n, duration, output, user_email=None):
             file_id = mongo_handler.store_song(
                 trimmed_path,
                 singer,
-                CURRENT_SESSION_ID,
+                ctx.session_id,
                 file_type="trimmed",
                 source_filename=source_filename,
                 append_to_session=False,
             )
             if file_id:
                 file_ids.append(file_id)
-        mongo_handler.append_session_songs(CURRENT_SESSION_ID, file_ids)
-    merge_with_crossfade(trimmed, output)
-    
-    return CURRENT_SESSION_ID
+        mongo_handler.append_session_songs(ctx.session_id, file_ids)
+    with job_scope(ctx.job_id):
+        merge_clips(trimmed, clips, output)
+    if ctx.ledger:
+        ctx.ledger.record_merge(output, ctx.session_id, ctx.artist_info)
+
+    return ctx.session_id
 
 
 if __name__ == "__main__":
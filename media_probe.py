@@ -0,0 +1,306 @@
+"""Track durations without a subprocess: download metadata, then container headers, then ffprobe"""
+
+import os
+import struct
+import subprocess
+import threading
+from collections import OrderedDict
+from typing import BinaryIO, Dict, Optional
+
+from ffmpeg_scheduler import PRIORITY_PROBE, run_ffmpeg
+
+DURATION_MEMO_SIZE = 4096
+
+# Durations reported at download time, keyed by file path.
+_known: "OrderedDict[str, float]" = OrderedDict()
+_counts = {"info": 0, "header": 0, "ffprobe": 0}
+_lock = threading.Lock()
+
+
+def info_duration(info: Dict) -> Optional[float]:
+    """Length of the file yt-dlp actually wrote for this info dict.
+
+    Ranged downloads only contain section_start..section_end, so that window
+    wins over the full video duration.
+    """
+    start, end = info.get("section_start"), info.get("section_end")
+    if start is not None and end is not None and end > start:
+        return float(end - start)
+    duration = info.get("duration")
+    return float(duration) if duration else None
+
+
+def remember_duration(path: str, seconds: Optional[float]) -> None:
+    if not seconds or seconds <= 0:
+        return
+    with _lock:
+        _known[path] = float(seconds)
+        _known.move_to_end(path)
+        while len(_known) > DURATION_MEMO_SIZE:
+            _known.popitem(last=False)
+
+
+def _read_mp4(fh: BinaryIO, size: int) -> Optional[float]:
+    def boxes(start: int, end: int):
+        pos = start
+        while pos + 8 <= end:
+            fh.seek(pos)
+            box_size, box_type = struct.unpack(">I4s", fh.read(8))
+            header = 8
+            if box_size == 1:
+                box_size = struct.unpack(">Q", fh.read(8))[0]
+                header = 16
+            elif box_size == 0:
+                box_size = end - pos
+            if box_size < header:
+                return
+            yield box_type, pos + header, pos + box_size
+            pos += box_size
+
+    for box_type, body, end in boxes(0, size):
+        if box_type != b"moov":
+            continue
+        timescale, duration, fragment_duration = 0, 0, 0
+        for child, child_body, child_end in boxes(body, end):
+            if child == b"mvhd":
+                fh.seek(child_body)
+                version = fh.read(4)[0]
+                if version == 1:
+                    timescale, duration = struct.unpack(">IQ", fh.read(28)[16:])
+                else:
+                    timescale, duration = struct.unpack(">II", fh.read(16)[8:])
+            elif child == b"mvex":
+                # Fragmented files keep the total length in mvex/mehd.
+                for grandchild, gc_body, _ in boxes(child_body, child_end):
+                    if grandchild == b"mehd":
+                        fh.seek(gc_body)
+                        fmt = ">Q" if fh.read(4)[0] == 1 else ">I"
+                        fragment_duration = struct.unpack(fmt, fh.read(struct.calcsize(fmt)))[0]
+        if duration in (0, 0xFFFFFFFF, 0xFFFFFFFFFFFFFFFF):
+            duration = fragment_duration
+        return duration / timescale if timescale and duration else None
+    return None
+
+
+def _read_vint(fh: BinaryIO, keep_marker: bool) -> Optional[int]:
+    first = fh.read(1)
+    if not first:
+        return None
+    value = first[0]
+    length = 1
+    mask = 0x80
+    while length <= 8 and not value & mask:
+        mask >>= 1
+        length += 1
+    if length > 8:
+        return None
+    if not keep_marker:
+        value &= mask - 1
+    for byte in fh.read(length - 1):
+        value = (value << 8) | byte
+    if not keep_marker and value == (1 << (7 * length)) - 1:
+        return -1  # unknown size
+    return value
+
+
+def _read_ebml(fh: BinaryIO, size: int) -> Optional[float]:
+    segment, info, scale_id, duration_id, cluster = 0x18538067, 0x1549A966, 0x2AD7B1, 0x4489, 0x1F43B675
+    end = size
+    fh.seek(0)
+    timecode_scale = 1_000_000
+    while fh.tell() < min(end, size):
+        element = _read_vint(fh, keep_marker=True)
+        length = _read_vint(fh, keep_marker=False)
+        if element is None or length is None:
+            return None
+        body = fh.tell()
+        if element in (segment, info):
+            # Descend into containers; an unknown size runs to the parent's end.
+            if length >= 0:
+                end = min(end, body + length)
+            continue
+        if element == cluster:
+            return None  # audio data reached without an Info duration
+        if length < 0:
+            return None
+        data = fh.read(length)
+        if element == scale_id:
+            timecode_scale = int.from_bytes(data, "big")
+        elif element == duration_id:
+            # Duration may come before TimecodeScale; read the rest of Info first.
+            duration = struct.unpack(">f" if length == 4 else ">d", data)[0]
+            while fh.tell() < end:
+                nxt = _read_vint(fh, keep_marker=True)
+                nxt_len = _read_vint(fh, keep_marker=False)
+                if nxt is None or nxt_len is None or nxt_len < 0:
+                    break
+                nxt_data = fh.read(nxt_len)
+                if nxt == scale_id:
+                    timecode_scale = int.from_bytes(nxt_data, "big")
+            return duration * timecode_scale / 1e9
+        fh.seek(body + length)
+    return None
+
+
+def _read_ogg(fh: BinaryIO, size: int) -> Optional[float]:
+    fh.seek(0)
+    head = fh.read(512)
+    segments = head[26]
+    packet = head[27 + segments:]
+    if packet.startswith(b"OpusHead"):
+        rate, pre_skip = 48000, struct.unpack("<H", packet[10:12])[0]
+    elif packet.startswith(b"\x01vorbis"):
+        rate, pre_skip = struct.unpack("<I", packet[12:16])[0], 0
+    else:
+        return None
+
+    fh.seek(max(0, size - 65536))
+    tail = fh.read()
+    last = tail.rfind(b"OggS")
+    if last < 0 or last + 14 > len(tail) or not rate:
+        return None
+    granule = struct.unpack("<q", tail[last + 6:last + 14])[0]
+    return max(0, granule - pre_skip) / rate
+
+
+def _read_wav(fh: BinaryIO, size: int) -> Optional[float]:
+    fh.seek(12)
+    byte_rate = None
+    while True:
+        header = fh.read(8)
+        if len(header) < 8:
+            return None
+        chunk_id, chunk_size = struct.unpack("<4sI", header)
+        if chunk_id == b"fmt ":
+            byte_rate = struct.unpack("<I", fh.read(chunk_size)[8:12])[0]
+            if chunk_size % 2:
+                fh.read(1)
+        elif chunk_id == b"data":
+            if not byte_rate:
+                return None
+            # Streamed WAVs leave the size unset; use what is on disk.
+            data_size = min(chunk_size, size - fh.tell())
+            return data_size / byte_rate
+        else:
+            fh.seek(chunk_size + chunk_size % 2, os.SEEK_CUR)
+
+
+def _read_flac(fh: BinaryIO, size: int) -> Optional[float]:
+    fh.seek(4)
+    block = fh.read(4 + 34)
+    if block[0] & 0x7F != 0:
+        return None
+    packed = int.from_bytes(block[4 + 10:4 + 18], "big")
+    rate, total = packed >> 44, packed & ((1 << 36) - 1)
+    return total / rate if rate and total else None
+
+
+_MP3_BITRATES = {
+    1: [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320],
+    2: [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+}
+_MP3_RATES = {1: [44100, 48000, 32000], 2: [22050, 24000, 16000], 25: [11025, 12000, 8000]}
+
+
+def _read_mp3(fh: BinaryIO, size: int) -> Optional[float]:
+    fh.seek(0)
+    start = 0
+    head = fh.read(10)
+    if head.startswith(b"ID3") and len(head) == 10:
+        tag_size = (head[6] << 21) | (head[7] << 14) | (head[8] << 7) | head[9]
+        start = 10 + tag_size + (10 if head[5] & 0x10 else 0)
+
+    fh.seek(start)
+    buf = fh.read(4096)
+    for i in range(len(buf) - 4):
+        if buf[i] != 0xFF or buf[i + 1] & 0xE0 != 0xE0:
+            continue
+        version_bits = (buf[i + 1] >> 3) & 0x3
+        layer_bits = (buf[i + 1] >> 1) & 0x3
+        bitrate_index = buf[i + 2] >> 4
+        rate_index = (buf[i + 2] >> 2) & 0x3
+        if version_bits == 1 or layer_bits != 1 or bitrate_index in (0, 15) or rate_index == 3:
+            continue  # reserved values or not layer III
+        version = {3: 1, 2: 2, 0: 25}[version_bits]
+        rate = _MP3_RATES[version][rate_index]
+        bitrate = _MP3_BITRATES[1 if version == 1 else 2][bitrate_index] * 1000
+        mono = (buf[i + 3] >> 6) == 3
+        samples_per_frame = 1152 if version == 1 else 576
+
+        side_info = (17 if mono else 32) if version == 1 else (9 if mono else 17)
+        xing = buf[i + 4 + side_info:i + 4 + side_info + 12]
+        if xing[:4] in (b"Xing", b"Info") and struct.unpack(">I", xing[4:8])[0] & 1:
+            frames = struct.unpack(">I", xing[8:12])[0]
+            return frames * samples_per_frame / rate
+        vbri = buf[i + 36:i + 36 + 18]
+        if vbri[:4] == b"VBRI":
+            frames = struct.unpack(">I", vbri[14:18])[0]
+            return frames * samples_per_frame / rate
+        # No VBR header: assume constant bitrate.
+        return (size - start - i) * 8 / bitrate
+    return None
+
+
+def header_duration(path: str) -> Optional[float]:
+    """Duration read from the container header, or None when the format is not understood"""
+    try:
+        size = os.path.getsize(path)
+        with open(path, "rb") as fh:
+            magic = fh.read(12)
+            if magic[4:8] == b"ftyp":
+                reader = _read_mp4
+            elif magic[:4] == b"\x1a\x45\xdf\xa3":
+                reader = _read_ebml
+            elif magic[:4] == b"OggS":
+                reader = _read_ogg
+            elif magic[:4] == b"RIFF" and magic[8:12] == b"WAVE":
+                reader = _read_wav
+            elif magic[:4] == b"fLaC":
+                reader = _read_flac
+            elif magic[:3] == b"ID3" or (magic[0] == 0xFF and magic[1] & 0xE0 == 0xE0):
+                reader = _read_mp3
+            else:
+                return None
+            duration = reader(fh, size)
+    except (OSError, struct.error, IndexError, ValueError, KeyError):
+        return None
+    return duration if duration and duration > 0 else None
+
+
+def ffprobe_duration(path: str) -> float:
+    result = run_ffmpeg(
+        ["ffprobe", "-v", "error", "-show_entries", "format=duration",
+         "-of", "default=nw=1:nk=1", path],
+        PRIORITY_PROBE,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+        text=True,
+        check=True,
+        timeout=10
+    )
+    try:
+        return float(result.stdout.strip())
+    except ValueError:
+        raise RuntimeError(f"Could not read duration for: {path}")
+
+
+def probe_duration(path: str) -> float:
+    """Seconds of audio in path, spawning ffprobe only when nothing cheaper knows"""
+    with _lock:
+        known = _known.get(path)
+    if known:
+        source, duration = "info", known
+    else:
+        duration = header_duration(path)
+        source = "header"
+        if duration is None:
+            source, duration = "ffprobe", ffprobe_duration(path)
+    with _lock:
+        _counts[source] += 1
+    return duration
+
+
+def probe_stats() -> Dict[str, int]:
+    """How many durations came from download metadata, headers and ffprobe"""
+    with _lock:
+        return dict(_counts)
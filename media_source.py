@@ -0,0 +1,188 @@
+"""Pluggable search/download backends: YouTube or an offline local audio library"""
+
+import hashlib
+import os
+import re
+import threading
+from abc import ABC, abstractmethod
+from typing import Callable, Dict, List, Optional, Tuple
+
+from pydub.utils import mediainfo
+
+from audio_cache import link_or_copy
+from downloader import RangeFn, build_ydl_opts, download_entries, search_entries
+from envelope_cache import remember_track
+from ffmpeg_scheduler import PRIORITY_PROBE, ffmpeg_slot
+from media_probe import remember_duration
+
+AUDIO_EXTENSIONS = (".mp3", ".m4a", ".webm", ".opus", ".ogg", ".wav", ".flac", ".aac")
+
+DownloadResult = Tuple[List[Tuple[str, Dict]], Dict[str, str]]
+
+
+class MediaSource(ABC):
+    """Where candidate tracks and their audio come from.
+
+    Entries returned by search() carry the same lightweight fields as the
+    YouTube search cache (webpage_url, id, title, duration, thumbnail,
+    uploader, view_count); download() places files according to a yt-dlp
+    style outtmpl and uses job_id to share network capacity fairly between
+    jobs. selection_seed, when set, makes the candidate pick repeatable.
+    """
+
+    name = "base"
+    selection_seed: Optional[str] = None
+
+    @abstractmethod
+    def search(self, query: str, suffix: str, count: int) -> List[Dict]:
+        ...
+
+    @abstractmethod
+    def download(
+        self,
+        entries: List[Dict],
+        outtmpl: str,
+        max_workers: Optional[int] = None,
+        ranges: Optional[RangeFn] = None,
+        on_downloaded: Optional[Callable[[int, str, Dict], None]] = None,
+        job_id: Optional[str] = None,
+    ) -> DownloadResult:
+        ...
+
+
+class YouTubeSource(MediaSource):
+    name = "youtube"
+
+    def search(self, query: str, suffix: str, count: int) -> List[Dict]:
+        return search_entries(build_ydl_opts(""), query, suffix, count)
+
+    def download(self, entries, outtmpl, max_workers=None, ranges=None, on_downloaded=None, job_id=None) -> DownloadResult:
+        return download_entries(
+            entries,
+            build_ydl_opts(outtmpl),
+            max_workers=max_workers,
+            ranges=ranges,
+            on_downloaded=on_downloaded,
+            job_id=job_id,
+        )
+
+
+class LocalLibrarySource(MediaSource):
+    """Serves audio files under root, matched on artist/title tags and path.
+
+    Tags are read once per file with ffprobe (via pydub.utils.mediainfo); files
+    without tags fall back to <artist dir>/<title>.<ext>. Nothing touches the
+    network and candidates are picked with a fixed seed, so runs are
+    reproducible for benchmarks and on-prem libraries; pass seed=None for
+    the usual random pick.
+    """
+
+    name = "local"
+
+    def __init__(self, root: str, seed: Optional[str] = "local"):
+        if not os.path.isdir(root):
+            raise RuntimeError(f"Local media library not found: {root}")
+        self.root = os.path.abspath(root)
+        self.selection_seed = seed
+        self._index: Optional[List[Dict]] = None
+        self._lock = threading.Lock()
+
+    def _describe(self, path: str) -> Dict:
+        rel = os.path.relpath(path, self.root)
+        parent = os.path.basename(os.path.dirname(path))
+        entry = {
+            "id": "local-" + hashlib.sha1(rel.encode("utf-8")).hexdigest()[:16],
+            "title": os.path.splitext(os.path.basename(path))[0],
+            "uploader": parent if parent and os.path.dirname(path) != self.root else "",
+            "duration": None,
+            "thumbnail": "",
+            "webpage_url": "file://" + path,
+            "_local_path": path,
+        }
+        try:
+            with ffmpeg_slot(PRIORITY_PROBE):
+                info = mediainfo(path)
+            tags = {k.lower(): v for k, v in (info.get("TAG") or {}).items()}
+            entry["title"] = tags.get("title") or entry["title"]
+            entry["uploader"] = tags.get("artist") or tags.get("album_artist") or entry["uploader"]
+            if info.get("duration"):
+                entry["duration"] = float(info["duration"])
+        except Exception:
+            pass
+        return entry
+
+    def index(self) -> List[Dict]:
+        with self._lock:
+            if self._index is None:
+                paths = []
+                for dirpath, _, filenames in os.walk(self.root):
+                    paths.extend(
+                        os.path.join(dirpath, f) for f in filenames
+                        if f.lower().endswith(AUDIO_EXTENSIONS)
+                    )
+                self._index = [self._describe(p) for p in sorted(paths)]
+                print(f"Local library indexed: {len(self._index)} files in {self.root}")
+            return self._index
+
+    def search(self, query: str, suffix: str, count: int) -> List[Dict]:
+        # The suffix ("songs"/"audio") only steers YouTube ranking; it is ignored here.
+        # Whole words of the tags and the path below root, so the library's
+        # own location and digits inside names ("Artist1") never match.
+        tokens = re.findall(r"\w+", query.lower())
+        matches = []
+        for entry in self.index():
+            haystack = " ".join(
+                (entry["uploader"] or "", entry["title"] or "", os.path.relpath(entry["_local_path"], self.root))
+            ).lower()
+            words = set(re.findall(r"\w+", haystack))
+            if all(token in words for token in tokens):
+                matches.append(dict(entry))
+        return matches[:count]
+
+    def download(self, entries, outtmpl, max_workers=None, ranges=None, on_downloaded=None, job_id=None) -> DownloadResult:
+        downloaded: List[Tuple[str, Dict]] = []
+        failures: Dict[str, str] = {}
+        for index, entry in enumerate(entries):
+            src = entry.get("_local_path")
+            try:
+                title = re.sub(r'[\\/:*?"<>|]', "_", entry.get("title") or "track")
+                ext = os.path.splitext(src)[1].lstrip(".")
+                dest = outtmpl.replace("%(title)s", title).replace("%(ext)s", ext)
+                os.makedirs(os.path.dirname(dest) or ".", exist_ok=True)
+                if os.path.exists(dest):
+                    os.remove(dest)
+                link_or_copy(src, dest)
+            except Exception as e:
+                failures[entry.get("webpage_url") or str(src)] = str(e)
+                print(f"Local copy failed for {src}: {e}")
+                continue
+
+            info = dict(entry, _local=True)
+            remember_duration(dest, entry.get("duration"))
+            remember_track(dest, entry.get("id"))
+            downloaded.append((dest, info))
+            if on_downloaded:
+                on_downloaded(index, dest, info)
+
+        print(f"Linked {len(downloaded)}/{len(entries)} tracks from local library")
+        return downloaded, failures
+
+
+def source_from_spec(spec: str) -> MediaSource:
+    """Build a source from "youtube" or "local:<library dir>" """
+    if spec.startswith("local:"):
+        return LocalLibrarySource(spec[len("local:"):])
+    if spec in ("", "youtube"):
+        return YouTubeSource()
+    raise RuntimeError(f"Unknown media source: {spec}")
+
+
+_DEFAULT_SOURCE: Optional[MediaSource] = None
+
+
+def default_source() -> MediaSource:
+    """Process-wide source chosen by MASHUP_MEDIA_SOURCE (defaults to YouTube)"""
+    global _DEFAULT_SOURCE
+    if _DEFAULT_SOURCE is None:
+        _DEFAULT_SOURCE = source_from_spec(os.getenv("MASHUP_MEDIA_SOURCE", "youtube"))
+    return _DEFAULT_SOURCE
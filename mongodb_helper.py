@@ -10,10 +10,17 @@ try:
 except Exception:
     certifi = None
 from gridfs import GridFS
+from bson import ObjectId
 from datetime import datetime
 
 load_dotenv()
 
+def _session_ref(session_id):
+    """Session id as stored in MongoDB; ids restored from a job ledger come back as strings"""
+    if isinstance(session_id, str) and ObjectId.is_valid(session_id):
+        return ObjectId(session_id)
+    return session_id
+
 def _find_ca_file() -> str:
     env_path = os.getenv("MONGO_TLS_CA_FILE")
     if env_path and os.path.exists(env_path):
@@ -172,7 +179,7 @@ class MongoDBHandler:
 
         try:
             self.songs_collection.update_one(
-                {"_id": session_id},
+                {"_id": _session_ref(session_id)},
                 {"$push": {"song_ids": {"$each": list(file_ids)}}}
             )
             return True
@@ -186,7 +193,7 @@ class MongoDBHandler:
             return False
             
         try:
-            sid = session_id or self.current_session_id
+            sid = _session_ref(session_id or self.current_session_id)
             if not sid:
                 return False
             
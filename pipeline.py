@@ -0,0 +1,141 @@
+"""Streaming download -> trim -> merge-prep pipeline with observable queue depths"""
+
+import itertools
+import os
+import queue
+import threading
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from ffmpeg_scheduler import FFMPEG_SLOTS, job_scope
+
+# Trim threads only queue for ffmpeg slots, so by default a lone job can fill them all.
+TRIM_WORKERS = max(1, int(os.getenv("MASHUP_TRIM_WORKERS", str(FFMPEG_SLOTS))))
+
+_STOP = object()
+
+# Live pipelines by name, read by pipeline_depths() for monitoring.
+_ACTIVE: Dict[str, "StreamingPipeline"] = {}
+_ACTIVE_LOCK = threading.Lock()
+_SEQ = itertools.count(1)
+
+
+class StreamingPipeline:
+    """Downloads are submitted as they finish, trimmed on a worker pool and handed
+    to a single merge-prep consumer (decode/normalize) as each clip is ready.
+
+    Items carry an ordering key so finish() returns results in a deterministic
+    order no matter which download or trim completes first. ffmpeg work done
+    by the stages is charged to job_id in the ffmpeg scheduler.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        trim_fn: Callable[[str], str],
+        prepare_fn: Optional[Callable[[str], Any]] = None,
+        trim_workers: int = TRIM_WORKERS,
+        job_id: Optional[str] = None,
+    ):
+        self.name = f"{name}-{next(_SEQ)}"
+        self.trim_fn = trim_fn
+        self.prepare_fn = prepare_fn
+        self.job_id = job_id
+        self.trim_queue: "queue.Queue" = queue.Queue()
+        self.merge_queue: "queue.Queue" = queue.Queue()
+        self.failures: Dict[str, str] = {}
+        self._results: List[Tuple[Any, str, Any]] = []
+        self._lock = threading.Lock()
+        self._counts = {"submitted": 0, "trimming": 0, "trimmed": 0, "prepared": 0}
+
+        self._trimmers = [
+            threading.Thread(target=self._trim_loop, daemon=True)
+            for _ in range(max(1, trim_workers))
+        ]
+        self._merger = threading.Thread(target=self._merge_loop, daemon=True)
+        for thread in self._trimmers + [self._merger]:
+            thread.start()
+
+        with _ACTIVE_LOCK:
+            _ACTIVE[self.name] = self
+
+    def submit(self, key: Any, path: str) -> None:
+        with self._lock:
+            self._counts["submitted"] += 1
+        self.trim_queue.put((key, path))
+
+    def _trim_loop(self) -> None:
+        with job_scope(self.job_id):
+            self._drain_trims()
+
+    def _drain_trims(self) -> None:
+        while True:
+            item = self.trim_queue.get()
+            if item is _STOP:
+                return
+            key, path = item
+            with self._lock:
+                self._counts["trimming"] += 1
+            try:
+                out_path = self.trim_fn(path)
+                with self._lock:
+                    self._counts["trimmed"] += 1
+                self.merge_queue.put((key, out_path))
+                print(f"Trimmed: {os.path.basename(out_path)}")
+            except Exception as e:
+                self.failures[path] = str(e)
+                print(f"Skipped {os.path.basename(path)}: {e}")
+            finally:
+                with self._lock:
+                    self._counts["trimming"] -= 1
+
+    def _merge_loop(self) -> None:
+        with job_scope(self.job_id):
+            self._drain_merges()
+
+    def _drain_merges(self) -> None:
+        while True:
+            item = self.merge_queue.get()
+            if item is _STOP:
+                return
+            key, out_path = item
+            try:
+                prepared = self.prepare_fn(out_path) if self.prepare_fn else None
+                with self._lock:
+                    self._results.append((key, out_path, prepared))
+                    self._counts["prepared"] += 1
+            except Exception as e:
+                self.failures[out_path] = str(e)
+                print(f"Skipped {os.path.basename(out_path)}: {e}")
+
+    def depths(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "trim_queue": self.trim_queue.qsize(),
+                "trimming": self._counts["trimming"],
+                "merge_queue": self.merge_queue.qsize(),
+                "submitted": self._counts["submitted"],
+                "trimmed": self._counts["trimmed"],
+                "prepared": self._counts["prepared"],
+            }
+
+    def finish(self) -> Tuple[List[str], List[Any]]:
+        """Drain every stage and return (trimmed paths, prepared clips) in key order"""
+        for _ in self._trimmers:
+            self.trim_queue.put(_STOP)
+        for thread in self._trimmers:
+            thread.join()
+        self.merge_queue.put(_STOP)
+        self._merger.join()
+
+        with _ACTIVE_LOCK:
+            _ACTIVE.pop(self.name, None)
+
+        ordered = sorted(self._results, key=lambda item: item[0])
+        return [path for _, path, _ in ordered], [prepared for _, _, prepared in ordered]
+
+
+def pipeline_depths() -> Dict[str, Dict[str, int]]:
+    """Queue depths of every running pipeline, keyed by pipeline name"""
+    with _ACTIVE_LOCK:
+        pipelines = list(_ACTIVE.items())
+    return {name: p.depths() for name, p in pipelines}
@@ -0,0 +1,66 @@
+"""In-process TTL cache for ytsearch results"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+SEARCH_CACHE_TTL = float(os.getenv("MASHUP_SEARCH_CACHE_TTL", "21600"))
+SEARCH_CACHE_SIZE = int(os.getenv("MASHUP_SEARCH_CACHE_SIZE", "256"))
+
+# Only what candidate scoring and the download stage read; full info dicts
+# are far too heavy to keep.
+ENTRY_FIELDS = ("webpage_url", "id", "title", "duration", "thumbnail", "uploader", "view_count")
+
+SearchKey = Tuple[str, str, int]
+
+
+def normalize_query(query: str) -> str:
+    return " ".join(query.lower().split())
+
+
+def slim_entry(entry: Dict) -> Dict:
+    return {field: entry.get(field) for field in ENTRY_FIELDS if entry.get(field) is not None}
+
+
+class SearchCache:
+    """Thread-safe LRU of search results that expire after ttl seconds"""
+
+    def __init__(self, ttl: float, max_entries: int):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._items: "OrderedDict[SearchKey, Tuple[float, List[Dict]]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(query: str, suffix: str, count: int) -> SearchKey:
+        return normalize_query(query), suffix, count
+
+    def get(self, key: SearchKey) -> Optional[List[Dict]]:
+        if self.ttl <= 0 or self.max_entries <= 0:
+            return None
+
+        with self._lock:
+            item = self._items.get(key)
+            if not item:
+                return None
+            stored_at, entries = item
+            if time.monotonic() - stored_at > self.ttl:
+                del self._items[key]
+                return None
+            self._items.move_to_end(key)
+            return [dict(e) for e in entries]
+
+    def put(self, key: SearchKey, entries: List[Dict]) -> None:
+        if self.ttl <= 0 or self.max_entries <= 0 or not entries:
+            return
+
+        with self._lock:
+            self._items[key] = (time.monotonic(), [slim_entry(e) for e in entries])
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_entries:
+                self._items.popitem(last=False)
+
+
+search_cache = SearchCache(SEARCH_CACHE_TTL, SEARCH_CACHE_SIZE)
@@ -0,0 +1,80 @@
+"""Benchmark the premium EQ and check it against pydub's filter chain.
+
+Usage: python bench_eq_bands.py [seconds]
+
+Renders the same synthetic stereo mix through _apply_eq_bands (SciPy
+second-order sections) and _apply_eq_bands_pydub, prints both timings and
+how far apart the outputs are, and exits non-zero if they differ by more
+than MAX_DIFF_DB. The first WARMUP_MS are reported separately: pydub starts
+each band's filter on the first sample, the SOS filter starts settled.
+"""
+
+import os
+import sys
+import time
+
+import numpy as np
+from pydub import AudioSegment
+
+# multimash_core imports the shared modules from the repo root.
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+import multimash_core
+from multimash_core import _apply_eq_bands, _apply_eq_bands_pydub
+
+# Difference energy allowed relative to the reference output.
+MAX_DIFF_DB = -60.0
+WARMUP_MS = 5
+
+
+def synthetic_mix(seconds: float, frame_rate: int = 44100) -> AudioSegment:
+    """Tones across every band plus pink-ish noise, about -12 dBFS, different per channel"""
+    rng = np.random.default_rng(7)
+    t = np.arange(int(seconds * frame_rate)) / frame_rate
+    channels = []
+    for offset in (0.0, 0.3):
+        tones = sum(np.sin(2 * np.pi * hz * t + offset) / (i + 1) for i, hz in enumerate((60, 300, 1000, 3000, 8000)))
+        noise = np.cumsum(rng.standard_normal(len(t))) * 0.002
+        noise -= np.convolve(noise, np.ones(512) / 512, mode="same")
+        channels.append(tones * 0.15 + noise)
+    pcm = (np.stack(channels, axis=1) * 32767).clip(-32768, 32767).astype(np.int16)
+    return AudioSegment(pcm.tobytes(), sample_width=2, frame_rate=frame_rate, channels=2)
+
+
+def main() -> int:
+    if multimash_core.signal is None:
+        print("SciPy is not installed; _apply_eq_bands falls back to pydub filters")
+        return 1
+
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 30.0
+    mix = synthetic_mix(seconds)
+
+    start = time.perf_counter()
+    reference = _apply_eq_bands_pydub(mix)
+    pydub_sec = time.perf_counter() - start
+
+    start = time.perf_counter()
+    result = _apply_eq_bands(mix)
+    sos_sec = time.perf_counter() - start
+
+    ref = np.frombuffer(reference.raw_data, dtype=np.int16).astype(np.float64)
+    out = np.frombuffer(result.raw_data, dtype=np.int16).astype(np.float64)
+    if len(ref) != len(out):
+        print(f"Length mismatch: {len(ref)} vs {len(out)} samples")
+        return 1
+    warmup = mix.frame_rate * WARMUP_MS // 1000 * mix.channels
+    diff = np.abs(ref - out)
+    diff_db = 10 * np.log10(np.mean(diff[warmup:] ** 2) / np.mean(ref[warmup:] ** 2))
+
+    print(f"{seconds:.0f} s stereo at {mix.frame_rate} Hz")
+    print(f"pydub filters: {pydub_sec:.2f} s")
+    print(f"SciPy SOS:     {sos_sec:.3f} s ({pydub_sec / sos_sec:.0f}x)")
+    print(f"Max sample difference: {diff[warmup:].max():.0f} ({diff[:warmup].max():.0f} in the first {WARMUP_MS} ms)")
+    print(f"Difference energy: {diff_db:.1f} dB relative to pydub output (limit {MAX_DIFF_DB:.0f} dB)")
+    return 0 if diff_db <= MAX_DIFF_DB else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,18 +1,42 @@
+import math
 import os
-import random
 import re
 import subprocess
-from array import array
-from collections import deque
-from typing import Dict, List, Optional, Tuple
+import wave
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import Callable, Dict, List, Optional, Tuple
 
+import numpy as np
 from pydub import AudioSegment
 from pydub.effects import compress_dynamic_range, normalize
-from yt_dlp import YoutubeDL
 
-from advanced_mashup import ensure_ffmpeg_tools, trim_mid_chunk
-from mashup_core import DOWNLOAD_DIR, TRIM_DIR, prepare_dirs
+try:
+    from scipy import signal
+except Exception:
+    signal = None
+
+from advanced_mashup import (
+    INTERMEDIATE_FORMAT,
+    MERGE_CHANNELS,
+    MERGE_SAMPLE_RATE,
+    clip_codec_args,
+    clip_path,
+    ensure_ffmpeg_tools,
+    export_mp3,
+    load_clip,
+    render_crossfade,
+)
+from candidates import split_candidates
+from dedupe import replace_duplicate_clips, with_fingerprint
+from downloader import RangeFn, loudest_range_fn, network_bytes
+from envelope_cache import ENVELOPE_STEP_MS, envelope_cache, loudest_start_ms, track_key
+from ffmpeg_scheduler import PRIORITY_TRIM, ffmpeg_slot, job_scope, run_ffmpeg
+from job_context import DOWNLOAD_DIR, TRIM_DIR, JobContext
+from job_ledger import download_with_ledger
+from media_source import MediaSource, default_source
 from mongodb_helper import mongo_handler
+from pipeline import StreamingPipeline
 
 
 def safe_slug(text: str) -> str:
@@ -20,23 +44,8 @@ def safe_slug(text: str) -> str:
     return (cleaned[:40] or "query").lower()
 
 
-def _build_ydl(prefix: str) -> YoutubeDL:
-    ydl_opts = {
-        "format": "bestaudio/best",
-        "outtmpl": os.path.join(DOWNLOAD_DIR, f"{prefix}-%(title)s.%(ext)s"),
-        "quiet": False,
-        "noplaylist": True,
-        "skip_unavailable_fragments": True,
-        "retries": 5,
-        "fragment_retries": 3,
-        "socket_timeout": 15,
-        "ignoreerrors": True,
-        "nocheckcertificate": True,
-        "extract_flat": False,
-        "match_filters": "!is_live & !is_upcoming",
-        "js_runtimes": {"node": {}},
-    }
-    return YoutubeDL(ydl_opts)
+def _outtmpl(prefix: str, download_dir: str = DOWNLOAD_DIR) -> str:
+    return os.path.join(download_dir, f"{prefix}-%(title)s.%(ext)s")
 
 
 def download_videos_for_query(
@@ -44,113 +53,130 @@ def download_videos_for_query(
     count: int,
     session_id: Optional[str],
     mode: str,
+    workers: Optional[int] = None,
+    ranges: Optional[RangeFn] = None,
+    on_downloaded: Optional[Callable[[int, str, Dict], None]] = None,
+    clip_sec: Optional[int] = None,
+    ctx: Optional[JobContext] = None,
+    source: Optional[MediaSource] = None,
 ) -> Tuple[Dict[str, Tuple[str, str]], List[str]]:
-    prefix = safe_slug(query)
-    if os.path.exists(DOWNLOAD_DIR):
-        before_files = {entry.name for entry in os.scandir(DOWNLOAD_DIR) if entry.is_file()}
-    else:
-        before_files = set()
+    ctx = ctx or JobContext()
+    source = source or default_source()
 
-    with _build_ydl(prefix) as ydl:
+    resumed = ctx.ledger.selection(query) if ctx.ledger else None
+    if resumed:
+        print(f"Resumed search selection for {query} from the job ledger")
+        selected, ctx.surplus[query] = resumed
+    else:
         search_suffix = "songs" if mode == "singer" else "audio"
-        search = f"ytsearch{count * 3}:{query} {search_suffix}"
-        info = ydl.extract_info(search, download=False)
-        entries = [e for e in (info.get("entries") or []) if e and e.get("webpage_url")]
+        entries = source.search(query, search_suffix, count * 3)
 
         if not entries:
             raise RuntimeError(f"No videos found for: {query}")
 
-        selected = random.sample(entries, min(count, len(entries))) if len(entries) > count else entries
+        selected, ctx.surplus[query] = split_candidates(entries, count, clip_sec, source.selection_seed)
+        if selected and ctx.ledger:
+            ctx.ledger.record_selection(query, selected, ctx.surplus[query])
+    if not selected:
+        raise RuntimeError(f"No usable videos found for: {query}")
 
-        for entry in selected:
-            url = entry.get("webpage_url")
-            if url:
-                ydl.download([url])
+    return download_selected_for_query(
+        query, selected, session_id, workers, ranges, on_downloaded, ctx, source
+    )
 
-    if os.path.exists(DOWNLOAD_DIR):
-        after_files = {entry.name for entry in os.scandir(DOWNLOAD_DIR) if entry.is_file()}
-    else:
-        after_files = set()
-    new_files = sorted(after_files - before_files)
+
+def download_selected_for_query(
+    query: str,
+    selected: List[Dict],
+    session_id: Optional[str],
+    workers: Optional[int] = None,
+    ranges: Optional[RangeFn] = None,
+    on_downloaded: Optional[Callable[[int, str, Dict], None]] = None,
+    ctx: Optional[JobContext] = None,
+    source: Optional[MediaSource] = None,
+) -> Tuple[Dict[str, Tuple[str, str]], List[str]]:
+    ctx = ctx or JobContext()
+    source = source or default_source()
+    downloaded, _ = download_with_ledger(
+        source,
+        selected,
+        _outtmpl(safe_slug(query), ctx.download_dir),
+        ctx.ledger,
+        max_workers=workers,
+        ranges=ranges,
+        on_downloaded=on_downloaded,
+        query=query,
+        job_id=ctx.job_id,
+    )
+    ctx.add_downloaded_bytes(network_bytes(downloaded))
 
     mapped: Dict[str, Tuple[str, str]] = {}
     new_paths: List[str] = []
-    for filename in new_files:
-        if not filename.startswith(prefix + "-"):
-            continue
+    for filepath in sorted({path for path, _ in downloaded}):
+        filename = os.path.basename(filepath)
         base_name, _ = os.path.splitext(filename)
         mapped[base_name] = (filename, query)
-        new_paths.append(os.path.join(DOWNLOAD_DIR, filename))
+        new_paths.append(filepath)
 
         if mongo_handler.connected and session_id:
-            filepath = os.path.join(DOWNLOAD_DIR, filename)
-            if os.path.isfile(filepath):
-                mongo_handler.store_song(
-                    filepath,
-                    query,
-                    session_id,
-                    file_type="download",
-                )
+            mongo_handler.store_song(
+                filepath,
+                query,
+                session_id,
+                file_type="download",
+            )
 
     return mapped, new_paths
 
 
-def trim_all_mid(
-    duration_sec: int,
-    meta_by_base: Dict[str, Tuple[str, str]],
-) -> Tuple[List[str], Dict[str, Tuple[str, str]]]:
-    ensure_ffmpeg_tools()
-    trimmed_files: List[str] = []
-    trimmed_meta: Dict[str, Tuple[str, str]] = {}
+# "single" decodes each source once and cuts the loudest window from a ring
+# buffer; "two-pass" analyzes a low-rate decode, then seeks and re-decodes.
+LOUDEST_MODE = os.getenv("MASHUP_LOUDEST_MODE", "single").lower()
 
-    for entry in os.scandir(DOWNLOAD_DIR):
-        if not entry.is_file():
-            continue
+# PCM is squared this many steps/milliseconds at a time to bound memory.
+ENVELOPE_CHUNK_STEPS = 64
+ENVELOPE_CHUNK_MS = 10000
 
-        file = entry.name
-        path = entry.path
 
-        base_name, _ = os.path.splitext(file)
-        out_name = base_name + ".mp3"
-        out_path = os.path.join(TRIM_DIR, out_name)
-
-        try:
-            trim_mid_chunk(path, out_path, duration_sec)
-            trimmed_files.append(out_path)
-            if base_name in meta_by_base:
-                trimmed_meta[base_name] = meta_by_base[base_name]
-        except Exception:
-            continue
-
-    return trimmed_files, trimmed_meta
+def _pcm_samples(segment: AudioSegment) -> np.ndarray:
+    """Interleaved samples of segment, viewed straight from its raw data"""
+    dtype = {1: np.int8, 2: np.int16, 4: np.int32}.get(segment.sample_width)
+    if dtype:
+        return np.frombuffer(segment.raw_data, dtype=dtype)
+    return np.array(segment.get_array_of_samples())
 
 
 def _find_loudest_start(segment: AudioSegment, window_ms: int, step_ms: int = 1000) -> int:
     if len(segment) <= window_ms:
         return 0
 
-    best_start = 0
-    best_score = -1.0
-    for start in range(0, len(segment) - window_ms + 1, step_ms):
-        window = segment[start:start + window_ms]
-        score = window.rms
-        if score > best_score:
-            best_score = score
-            best_start = start
-
-    return best_start
-
-
-def _find_loudest_start_streaming(path: str, window_ms: int, step_ms: int = 500) -> int:
-    """Find loudest window start without loading full audio into memory."""
+    samples = _pcm_samples(segment)
+    channels = segment.channels
+    n_ms = len(segment)
+    # Frame index of every millisecond boundary, as pydub slices them.
+    bounds = np.minimum(np.arange(n_ms + 1, dtype=np.int64) * segment.frame_rate // 1000, len(samples) // channels)
+
+    # Running sum of squared samples at each boundary, built chunk by chunk.
+    prefix = np.zeros(n_ms + 1)
+    for lo in range(0, n_ms, ENVELOPE_CHUNK_MS):
+        hi = min(n_ms, lo + ENVELOPE_CHUNK_MS)
+        block = samples[bounds[lo] * channels:bounds[hi] * channels].astype(np.float64)
+        running = np.concatenate(([0.0], np.cumsum(block * block)))
+        prefix[lo + 1:hi + 1] = prefix[lo] + running[(bounds[lo + 1:hi + 1] - bounds[lo]) * channels]
+
+    # Highest mean energy wins; argmax keeps the earliest window on ties.
+    starts = np.arange(0, n_ms - window_ms + 1, step_ms)
+    counts = np.maximum(bounds[starts + window_ms] - bounds[starts], 1)
+    means = (prefix[starts + window_ms] - prefix[starts]) / counts
+    return int(starts[int(np.argmax(means))])
+
+
+def _stream_envelope(path: str, step_ms: int = ENVELOPE_STEP_MS) -> np.ndarray:
+    """Mean energy per step_ms of a low-rate mono decode, read without holding the PCM"""
     ensure_ffmpeg_tools()
-    if window_ms <= 0:
-        return 0
-
     sample_rate = 22050
     step_samples = max(1, int(sample_rate * step_ms / 1000))
     step_bytes = step_samples * 2
-    window_steps = max(1, window_ms // step_ms)
 
     cmd = [
         "ffmpeg",
@@ -167,58 +193,40 @@ def _find_loudest_start_streaming(path: str, window_ms: int, step_ms: int = 500)
         "-",
     ]
 
-    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
-    if not proc.stdout:
-        return 0
-
-    energies = deque()
-    sum_energy = 0.0
-    best_sum = -1.0
-    best_end_idx = -1
-    step_idx = 0
+    with ffmpeg_slot(PRIORITY_TRIM):
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        if not proc.stdout:
+            return np.zeros(0)
 
-    try:
-        while True:
-            data = proc.stdout.read(step_bytes)
-            if not data or len(data) < step_bytes:
-                break
-
-            samples = array("h")
-            samples.frombytes(data)
-            if not samples:
-                break
-
-            # Energy per step; sliding sum finds the loudest window.
-            energy = sum(s * s for s in samples) / len(samples)
-            energies.append(energy)
-            sum_energy += energy
-
-            if len(energies) > window_steps:
-                sum_energy -= energies.popleft()
-
-            if len(energies) == window_steps and sum_energy > best_sum:
-                best_sum = sum_energy
-                best_end_idx = step_idx
-
-            step_idx += 1
-    finally:
-        proc.stdout.close()
+        # Only the per-step energy envelope is kept; PCM is read, squared and
+        # dropped a chunk at a time.
+        envelope: List[np.ndarray] = []
         try:
-            proc.wait(timeout=10)
-        except subprocess.TimeoutExpired:
-            proc.kill()
-            proc.wait()
-
-    if best_end_idx < 0:
-        return 0
+            while True:
+                data = proc.stdout.read(step_bytes * ENVELOPE_CHUNK_STEPS)
+                steps = len(data) // step_bytes
+                if not steps:
+                    break
+
+                samples = np.frombuffer(data, dtype="<i2", count=steps * step_samples).astype(np.float64)
+                envelope.append((samples * samples).reshape(steps, step_samples).mean(axis=1))
+
+                if len(data) < step_bytes * ENVELOPE_CHUNK_STEPS:
+                    break
+        finally:
+            proc.stdout.close()
+            try:
+                proc.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+                proc.wait()
 
-    best_start_step = best_end_idx - window_steps + 1
-    return max(0, best_start_step * step_ms)
+    return np.concatenate(envelope) if envelope else np.zeros(0)
 
 
 def _trim_chunk_at_start(path: str, out_path: str, start_sec: float, duration_sec: int) -> None:
     ensure_ffmpeg_tools()
-    subprocess.run(
+    run_ffmpeg(
         [
             "ffmpeg",
             "-y",
@@ -229,12 +237,10 @@ def _trim_chunk_at_start(path: str, out_path: str, start_sec: float, duration_se
             "-t",
             str(duration_sec),
             "-vn",
-            "-acodec",
-            "libmp3lame",
-            "-b:a",
-            "192k",
+            *clip_codec_args("192k"),
             out_path,
         ],
+        PRIORITY_TRIM,
         stdout=subprocess.DEVNULL,
         stderr=subprocess.DEVNULL,
         check=True,
@@ -242,60 +248,245 @@ def _trim_chunk_at_start(path: str, out_path: str, start_sec: float, duration_se
     )
 
 
-def trim_loudest_chunks_from_files(
-    duration_sec: int,
-    files: List[str],
-    meta_by_base: Dict[str, Tuple[str, str]],
-) -> Tuple[List[str], Dict[str, Tuple[str, str]]]:
-    ensure_ffmpeg_tools()
-    trimmed_files: List[str] = []
-    trimmed_meta: Dict[str, Tuple[str, str]] = {}
-    window_ms = duration_sec * 1000
+def _write_clip(pcm: bytes, out_path: str) -> None:
+    """Write merge-format s16le PCM as a clip in the intermediate format"""
+    if INTERMEDIATE_FORMAT == "wav":
+        with wave.open(out_path, "wb") as wav:
+            wav.setnchannels(MERGE_CHANNELS)
+            wav.setsampwidth(2)
+            wav.setframerate(MERGE_SAMPLE_RATE)
+            wav.writeframes(pcm)
+        return
+
+    run_ffmpeg(
+        [
+            "ffmpeg",
+            "-y",
+            "-v",
+            "error",
+            "-f",
+            "s16le",
+            "-ar",
+            str(MERGE_SAMPLE_RATE),
+            "-ac",
+            str(MERGE_CHANNELS),
+            "-i",
+            "pipe:0",
+            *clip_codec_args("192k"),
+            out_path,
+        ],
+        PRIORITY_TRIM,
+        input=pcm,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        check=True,
+        timeout=90,
+    )
+
 
-    for path in files:
-        if not os.path.isfile(path):
-            continue
+def _analyze_and_cut(path: str, out_path: str, duration_sec: int, step_ms: int = ENVELOPE_STEP_MS) -> Tuple[int, np.ndarray]:
+    """Decode path once, track the loudest window and write it to out_path.
 
-        file = os.path.basename(path)
+    PCM is decoded at the merge format into a ring buffer twice the window
+    long. When a new loudest window is found it is only marked; it is copied
+    out just before the ring would overwrite its first step, so memory stays
+    at about three windows whatever the track length. Returns the start in ms
+    and the per-step energy envelope.
+    """
+    ensure_ffmpeg_tools()
+    step_len = MERGE_SAMPLE_RATE * step_ms // 1000 * MERGE_CHANNELS
+    step_bytes = step_len * 2
+    window_steps = max(1, duration_sec * 1000 // step_ms)
+    capacity = 2 * window_steps
+    ring = np.empty((capacity, step_len), dtype=np.int16)
+    read_steps = max(1, 4000 // step_ms)
 
-        base_name, _ = os.path.splitext(file)
-        out_name = base_name + ".mp3"
-        out_path = os.path.join(TRIM_DIR, out_name)
+    def snapshot(end: int) -> np.ndarray:
+        return ring[[i % capacity for i in range(end - window_steps + 1, end + 1)]]
 
+    cmd = [
+        "ffmpeg",
+        "-v",
+        "error",
+        "-i",
+        path,
+        "-vn",
+        "-ac",
+        str(MERGE_CHANNELS),
+        "-ar",
+        str(MERGE_SAMPLE_RATE),
+        "-f",
+        "s16le",
+        "-",
+    ]
+    # The slot is held while decoding only; _write_clip takes its own.
+    with ffmpeg_slot(PRIORITY_TRIM):
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+
+        energies: List[float] = []
+        window_sum = 0.0
+        best_sum = -1.0
+        best_end = -1
+        best: Optional[np.ndarray] = None
+        tail = b""
+        step = 0
         try:
-            start_ms = _find_loudest_start_streaming(path, window_ms)
-            _trim_chunk_at_start(path, out_path, start_ms / 1000.0, duration_sec)
-            trimmed_files.append(out_path)
-            if base_name in meta_by_base:
-                trimmed_meta[base_name] = meta_by_base[base_name]
-        except Exception:
+            while True:
+                # Full-rate stereo steps are large, so read about 4 s at a time.
+                data = proc.stdout.read(step_bytes * read_steps)
+                steps = len(data) // step_bytes
+                if steps:
+                    rows = np.frombuffer(data, dtype="<i2", count=steps * step_len).reshape(steps, step_len)
+                    for row, energy in zip(rows, np.square(rows, dtype=np.float64).mean(axis=1)):
+                        if best is None and best_end >= 0 and step - capacity == best_end - window_steps + 1:
+                            best = snapshot(best_end)
+                        ring[step % capacity] = row
+
+                        energies.append(energy)
+                        window_sum += energy
+                        if step >= window_steps:
+                            window_sum -= energies[step - window_steps]
+                        if step >= window_steps - 1 and window_sum > best_sum:
+                            best_sum, best_end, best = window_sum, step, None
+                        step += 1
+
+                if len(data) < step_bytes * read_steps:
+                    tail = data[steps * step_bytes:]
+                    break
+        finally:
+            proc.stdout.close()
             try:
-                segment = AudioSegment.from_file(path)
-                start_ms = _find_loudest_start(segment, window_ms)
-                chunk = segment[start_ms:start_ms + window_ms]
-                chunk.export(out_path, format="mp3", bitrate="192k")
-                trimmed_files.append(out_path)
-                if base_name in meta_by_base:
-                    trimmed_meta[base_name] = meta_by_base[base_name]
-            except Exception:
-                continue
+                proc.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+                proc.wait()
 
-    return trimmed_files, trimmed_meta
+    if proc.returncode or not step:
+        raise RuntimeError(f"Could not decode {path}")
 
+    if best_end < 0:
+        # Shorter than the window: the whole track is still in the ring, in order.
+        frame_bytes = 2 * MERGE_CHANNELS
+        _write_clip(ring[:step].tobytes() + tail[:len(tail) - len(tail) % frame_bytes], out_path)
+        return 0, np.array(energies)
 
-def trim_loudest_chunks(
-    duration_sec: int,
-    meta_by_base: Dict[str, Tuple[str, str]],
-) -> Tuple[List[str], Dict[str, Tuple[str, str]]]:
-    files = [entry.path for entry in os.scandir(DOWNLOAD_DIR) if entry.is_file()]
-    return trim_loudest_chunks_from_files(duration_sec, files, meta_by_base)
+    _write_clip((best if best is not None else snapshot(best_end)).tobytes(), out_path)
+    return (best_end - window_steps + 1) * step_ms, np.array(energies)
+
+
+def trim_loudest_one(path: str, duration_sec: int, ctx: Optional[JobContext] = None) -> str:
+    """Cut the loudest duration_sec window of one download into the job's trim dir.
+
+    A cached loudness envelope (any clip length) picks the window without
+    decoding, so only the window itself is seeked to and cut. Otherwise the
+    track is analyzed and, when it is a known full track, its envelope cached
+    for later jobs.
+    """
+    window_ms = duration_sec * 1000
+    out_path = clip_path(ctx.trim_dir if ctx else TRIM_DIR, path)
+
+    try:
+        key = track_key(path)
+        envelope = envelope_cache.get(key)
+        if envelope is not None:
+            start_ms = loudest_start_ms(envelope, window_ms)
+            _trim_chunk_at_start(path, out_path, start_ms / 1000.0, duration_sec)
+        elif LOUDEST_MODE == "single":
+            _, envelope = _analyze_and_cut(path, out_path, duration_sec)
+            envelope_cache.put(key, envelope)
+        else:
+            envelope = _stream_envelope(path)
+            envelope_cache.put(key, envelope)
+            start_ms = loudest_start_ms(envelope, window_ms)
+            _trim_chunk_at_start(path, out_path, start_ms / 1000.0, duration_sec)
+    except Exception:
+        with ffmpeg_slot(PRIORITY_TRIM):
+            segment = AudioSegment.from_file(path)
+        start_ms = _find_loudest_start(segment, window_ms)
+        chunk = segment[start_ms:start_ms + window_ms]
+        if INTERMEDIATE_FORMAT == "wav":
+            _resample_stereo(chunk).set_sample_width(2).export(out_path, format="wav")
+        else:
+            with ffmpeg_slot(PRIORITY_TRIM):
+                chunk.export(out_path, format="mp3", bitrate="192k")
+
+    return out_path
 
 
 def _resample_stereo(segment: AudioSegment) -> AudioSegment:
     return segment.set_frame_rate(44100).set_channels(2)
 
 
+# (high-pass Hz, low-pass Hz, gain dB) of each EQ band; the bands are summed.
+EQ_BANDS = [
+    (None, 200, -1.5),
+    (200, 400, -3.0),
+    (400, 2000, 0.0),
+    (2000, 5000, 2.0),
+    (5000, None, 0.5),
+]
+EQ_CHUNK_SEC = 10
+
+
+def _rc_pole(cutoff: float, frame_rate: int) -> float:
+    """Pole of pydub's first-order RC filters; its low- and high-pass at one cutoff share it"""
+    rc = 1.0 / (cutoff * 2 * math.pi)
+    return rc / (rc + 1.0 / frame_rate)
+
+
+@lru_cache(maxsize=8)
+def _eq_sos(frame_rate: int) -> np.ndarray:
+    """EQ_BANDS as a single IIR filter in second-order sections.
+
+    Every band is a cascade of pydub's one-pole filters, so over a common
+    denominator (one pole per distinct cutoff) the gained bands add up to a
+    4th-order filter: two biquads instead of five filtered copies.
+    """
+    cutoffs = sorted({hz for band in EQ_BANDS for hz in band[:2] if hz})
+    poles = {hz: _rc_pole(hz, frame_rate) for hz in cutoffs}
+    denominator = np.array([1.0])
+    for hz in cutoffs:
+        denominator = np.convolve(denominator, [1.0, -poles[hz]])
+
+    numerator = np.zeros(len(denominator))
+    for high_pass, low_pass, gain_db in EQ_BANDS:
+        band = np.array([10 ** (gain_db / 20.0)])
+        if low_pass:
+            band = band * (1.0 - poles[low_pass])
+        if high_pass:
+            band = np.convolve(band, [poles[high_pass], -poles[high_pass]])
+        for hz in cutoffs:
+            if hz not in (high_pass, low_pass):
+                band = np.convolve(band, [1.0, -poles[hz]])
+        numerator[:len(band)] += band
+    return signal.tf2sos(numerator, denominator)
+
+
 def _apply_eq_bands(segment: AudioSegment) -> AudioSegment:
+    """Five-band EQ in one vectorized filter pass over all channels (pydub filters without SciPy)"""
+    if signal is None:
+        return _apply_eq_bands_pydub(segment)
+
+    samples = _pcm_samples(segment)
+    if not len(samples):
+        return segment
+    frames = samples.reshape(-1, segment.channels)
+    limits = np.iinfo(samples.dtype)
+    sos = _eq_sos(segment.frame_rate)
+    out = np.empty_like(frames)
+
+    # Unlike pydub's filters, start settled on the first frame, which skips
+    # their start-up transient (the outputs differ in the first few ms). The
+    # state is carried across chunks so only one chunk is ever in floating point.
+    state = signal.sosfilt_zi(sos)[:, :, None] * frames[0].astype(np.float64)
+    chunk = segment.frame_rate * EQ_CHUNK_SEC
+    for lo in range(0, len(frames), chunk):
+        filtered, state = signal.sosfilt(sos, frames[lo:lo + chunk].astype(np.float64), axis=0, zi=state)
+        out[lo:lo + chunk] = np.clip(np.trunc(filtered), limits.min, limits.max)
+    return segment._spawn(out.tobytes())
+
+
+def _apply_eq_bands_pydub(segment: AudioSegment) -> AudioSegment:
     low = segment.low_pass_filter(200).apply_gain(-1.5)
     mud = segment.low_pass_filter(400).high_pass_filter(200).apply_gain(-3.0)
     mid = segment.low_pass_filter(2000).high_pass_filter(400)
@@ -327,26 +518,29 @@ def _limit_and_normalize(segment: AudioSegment, target_dbfs: float = -14.0) -> A
     return limited
 
 
+def prepare_premium_clip(path: str, duration_sec: int) -> AudioSegment:
+    """Decode, resample and normalize one clip for merge_rotating_premium"""
+    segment = load_clip(path)[:duration_sec * 1000]
+    return normalize(_resample_stereo(segment))
+
+
 def merge_rotating_premium(
     files: List[str],
     output_file: str,
     duration_sec: int,
     crossfade_ms: int = 2400,
     bpm: int = 96,
+    prepared: Optional[List[AudioSegment]] = None,
 ) -> None:
-    if not files:
+    if not files and not prepared:
         raise RuntimeError("No audio files available to merge")
 
     duration_ms = duration_sec * 1000
     beat_interval = int(60000 / bpm)
     effective_fade = min(crossfade_ms, beat_interval * 2)
 
-    def prep(segment: AudioSegment) -> AudioSegment:
-        seg = _resample_stereo(segment)
-        seg = normalize(seg)
-        return seg
-
-    prepared = [prep(AudioSegment.from_file(f)[:duration_ms]) for f in files]
+    if prepared is None:
+        prepared = [prepare_premium_clip(f, duration_sec) for f in files]
 
     slice_ms = max(10000, min(14000, duration_ms // 2))
 
@@ -395,7 +589,7 @@ def merge_rotating_premium(
         return sum(chunks)
 
     offsets = [0 for _ in prepared]
-    base_mix: Optional[AudioSegment] = None
+    slices: List[AudioSegment] = []
 
     while True:
         progressed = False
@@ -404,20 +598,15 @@ def merge_rotating_premium(
                 continue
 
             progressed = True
-            slice_part = segment[offsets[idx]:offsets[idx] + slice_ms]
+            slices.append(segment[offsets[idx]:offsets[idx] + slice_ms])
             offsets[idx] += slice_ms
 
-            if base_mix is None:
-                base_mix = slice_part
-            else:
-                fade = min(effective_fade, len(base_mix) // 2, len(slice_part) // 2)
-                base_mix = base_mix.append(slice_part, crossfade=fade)
-
         if not progressed:
             break
 
-    if base_mix is None:
+    if not slices:
         raise RuntimeError("Unable to assemble mashup")
+    base_mix = render_crossfade(slices, effective_fade)
 
     total_ms = len(base_mix)
     ratios = [0.12, 0.16, 0.16, 0.16, 0.1, 0.16]
@@ -468,7 +657,7 @@ def merge_rotating_premium(
     processed = _multiband_compress(processed)
     processed = _limit_and_normalize(processed, target_dbfs=-14.0)
 
-    processed.export(output_file, format="mp3", bitrate="320k")
+    export_mp3(processed, output_file, "320k")
 
 
 def _split_counts(total: int, buckets: int) -> List[int]:
@@ -492,6 +681,8 @@ def run_multi_mashup(
     output: str,
     user_email: Optional[str] = None,
     mode: str = "singer",
+    ctx: Optional[JobContext] = None,
+    source: Optional[MediaSource] = None,
 ) -> Optional[str]:
     if not queries:
         raise RuntimeError("Please provide at least one singer or song.")
@@ -509,28 +700,100 @@ def run_multi_mashup(
     else:
         total_videos = len(queries)
 
-    session_id = None
+    ctx = ctx or JobContext()
+    if ctx.ledger and ctx.ledger.merged(output):
+        print(f"Job {ctx.job_id} already merged, reusing {output}")
+        return ctx.session_id
+
     if mongo_handler.connected and user_email:
-        session_id = mongo_handler.start_new_session(", ".join(queries), user_email)
+        ctx.session_id = mongo_handler.start_new_session(", ".join(queries), user_email)
+    session_id = ctx.session_id
 
-    prepare_dirs()
+    ctx.prepare()
     if mode == "song":
         counts = [1 for _ in queries]
     else:
         counts = _split_counts(total_videos, len(queries))
 
+    ensure_ffmpeg_tools()
+
+    def trim(path: str) -> str:
+        return trim_loudest_one(path, duration, ctx)
+
+    if ctx.ledger:
+        trim = ctx.ledger.trim_step(trim)
+    prepare = with_fingerprint(lambda path: prepare_premium_clip(path, duration))
+    pipeline = StreamingPipeline(f"multimash:{ctx.job_id}", trim, prepare, job_id=ctx.job_id)
+
+    def on_downloaded(query_idx: int):
+        return lambda index, path, info: pipeline.submit((query_idx, index), path)
+
     meta_by_base: Dict[str, Tuple[str, str]] = {}
-    downloaded_paths: List[str] = []
-    for query, count in zip(queries, counts):
-        meta, new_paths = download_videos_for_query(query, count, session_id, mode)
-        meta_by_base.update(meta)
-        downloaded_paths.extend(new_paths)
-
-    trimmed_files, trimmed_meta = trim_loudest_chunks_from_files(
-        duration,
-        downloaded_paths,
-        meta_by_base,
-    )
+    # Queries search and download side by side; the global slot cap in the
+    # downloader bounds total connections. Each finished download goes straight
+    # to the trim stage, and results are ordered by (query, entry) index.
+    try:
+        with ThreadPoolExecutor(max_workers=len(queries)) as executor:
+            futures = [
+                executor.submit(
+                    download_videos_for_query,
+                    query,
+                    count,
+                    session_id,
+                    mode,
+                    ranges=loudest_range_fn(duration),
+                    on_downloaded=on_downloaded(query_idx),
+                    clip_sec=duration,
+                    ctx=ctx,
+                    source=source,
+                )
+                for query_idx, (query, count) in enumerate(zip(queries, counts))
+            ]
+            for future in futures:
+                meta, _ = future.result()
+                meta_by_base.update(meta)
+    finally:
+        trimmed_files, prepared = pipeline.finish()
+
+    def refill(dropped: List[str]) -> Tuple[List[str], List[Tuple[AudioSegment, np.ndarray]]]:
+        # Replace each duplicate from the surplus of the query it came from.
+        wanted: Dict[str, int] = {}
+        for trimmed_path in dropped:
+            base_name, _ = os.path.splitext(os.path.basename(trimmed_path))
+            query = meta_by_base.get(base_name, (None, queries[0]))[1]
+            wanted[query] = wanted.get(query, 0) + 1
+
+        refill_pipeline = StreamingPipeline(f"multimash-refill:{ctx.job_id}", trim, prepare, job_id=ctx.job_id)
+        try:
+            for query_idx, (query, need) in enumerate(wanted.items()):
+                take = ctx.surplus.get(query, [])[:need]
+                ctx.surplus[query] = ctx.surplus.get(query, [])[len(take):]
+                if not take:
+                    continue
+                meta, _ = download_selected_for_query(
+                    query,
+                    take,
+                    session_id,
+                    ranges=loudest_range_fn(duration),
+                    on_downloaded=lambda index, path, info, q=query_idx: refill_pipeline.submit((q, index), path),
+                    ctx=ctx,
+                    source=source,
+                )
+                meta_by_base.update(meta)
+        finally:
+            refilled = refill_pipeline.finish()
+        return refilled
+
+    trimmed_files, prepared = replace_duplicate_clips(trimmed_files, prepared, refill)
+    clips = [clip for clip, _ in prepared]
+
+    print(f"Job {ctx.job_id} downloaded {ctx.bytes_downloaded / (1024 * 1024):.1f} MB")
+
+    trimmed_meta: Dict[str, Tuple[str, str]] = {}
+    for trimmed_path in trimmed_files:
+        base_name, _ = os.path.splitext(os.path.basename(trimmed_path))
+        if base_name in meta_by_base:
+            trimmed_meta[base_name] = meta_by_base[base_name]
 
     if mongo_handler.connected and session_id:
         file_ids = []
@@ -550,6 +813,9 @@ def run_multi_mashup(
                 file_ids.append(file_id)
         mongo_handler.append_session_songs(session_id, file_ids)
 
-    merge_rotating_premium(trimmed_files, output, duration)
+    with job_scope(ctx.job_id):
+        merge_rotating_premium(trimmed_files, output, duration, prepared=clips)
+    if ctx.ledger:
+        ctx.ledger.record_merge(output, ctx.session_id, ctx.artist_info)
 
     return session_id